@@ -0,0 +1,303 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import faiss
+from textblob import TextBlob
+
+from model import FeaturePipeline, build_faiss_index, get_file_path, read_dataset
+
+
+# Track names whose sentiment depends on case or spacing, always included when checking the labels agree
+SENTIMENT_EDGE_CASES = [":D", ":d", "Sad :D", "sad :d", "Bad Day :D", "Alone :D", "Alone  :D", "GREAT", " Intro ", "XD"]
+
+INDEX_TYPES = {
+    "Flat": None,
+    "IVF4096,Flat": "nprobe=64",
+    "HNSW32,Flat": "efSearch=128",
+    "IVF4096,PQ32": "nprobe=64",
+    "OPQ32,IVF4096,PQ32": "nprobe=64",
+}
+
+
+def sample_queries(feature_matrix, queries):
+    """
+    Samples track vectors to use as search queries, like the single track recommendations do
+
+    Args:
+        feature_matrix (numpy array): The normalised feature matrix
+        queries (int): The number of queries
+
+    Returns:
+        numpy array: The query vectors
+    """
+    rows = np.sort(np.random.default_rng(1).choice(len(feature_matrix), min(queries, len(feature_matrix)), replace=False))
+    return np.ascontiguousarray(feature_matrix[rows], dtype=np.float32)
+
+
+def time_queries(index, queries, k):
+    """
+    Searches the queries one at a time, as the app does
+
+    Args:
+        index (faiss.Index): The index to search
+        queries (numpy array): The query vectors
+        k (int): The number of neighbours to return
+
+    Returns:
+        tuple: The neighbour ids of every query and the latency of each search in milliseconds
+    """
+    ids = np.empty((len(queries), k), dtype=np.int64)
+    latencies = np.empty(len(queries))
+
+    for i in range(len(queries)):
+        start = time.perf_counter()
+        _, ids[i:i + 1] = index.search(queries[i:i + 1], k)
+        latencies[i] = (time.perf_counter() - start) * 1000
+
+    return ids, latencies
+
+
+def recall_at_k(ids, exact_ids):
+    """
+    The fraction of the exact nearest neighbours found by an approximate index
+
+    Args:
+        ids (numpy array): The neighbour ids returned by the approximate index
+        exact_ids (numpy array): The neighbour ids returned by the flat index
+
+    Returns:
+        float: The mean recall over all queries
+    """
+    found = [len(np.intersect1d(row, exact_row[exact_row >= 0])) / max((exact_row >= 0).sum(), 1)
+             for row, exact_row in zip(ids, exact_ids)]
+    return float(np.mean(found))
+
+
+def benchmark_index_types(feature_matrix, index_types=None, queries=1000, k=50, train_size=100000):
+    """
+    Builds each index type over the feature matrix and reports its recall@k against the exact flat index, query
+    latency, memory and build time
+
+    Args:
+        feature_matrix (numpy array): The normalised feature matrix
+        index_types (dict): Factory strings mapped to their search parameters, defaults to INDEX_TYPES
+        queries (int): The number of sampled track queries
+        k (int): The number of neighbours to compare
+        train_size (int): The number of vectors to train approximate indexes on
+
+    Returns:
+        list: A report for each index type
+    """
+    index_types = index_types or INDEX_TYPES
+    query_vectors = sample_queries(feature_matrix, queries)
+
+    exact_index = build_faiss_index(feature_matrix, "Flat")
+    _, exact_ids = exact_index.search(query_vectors, k)
+    del exact_index
+
+    results = []
+    for index_type, search_params in index_types.items():
+        start = time.perf_counter()
+        try:
+            index = build_faiss_index(feature_matrix, index_type, search_params, train_size)
+        except RuntimeError as e:
+            print(f"Skipping {index_type}: {e}")
+            continue
+        build_seconds = time.perf_counter() - start
+
+        ids, latencies = time_queries(index, query_vectors, k)
+        results.append({
+            "index_type": index_type,
+            "search_params": search_params,
+            f"recall@{k}": round(recall_at_k(ids, exact_ids), 4),
+            "latency_ms_p50": round(float(np.percentile(latencies, 50)), 3),
+            "latency_ms_p95": round(float(np.percentile(latencies, 95)), 3),
+            "memory_mb": round(faiss.serialize_index(index).nbytes / 1024 ** 2, 2),
+            "build_seconds": round(build_seconds, 2),
+        })
+        print(results[-1])
+        del index
+
+    return results
+
+
+def storage_types(dimensions):
+    """
+    The storage precisions to compare, each a matrix dtype paired with an index type that stores the vectors at that
+    precision. The product quantizer uses the largest number of sub-vectors of 2 dimensions or more that divides the
+    dimensions
+
+    Args:
+        dimensions (int): The number of features of each track vector
+
+    Returns:
+        dict: Names mapped to a matrix dtype and a FAISS factory string
+    """
+    m = max(m for m in range(1, dimensions // 2 + 1) if dimensions % m == 0) if dimensions > 1 else 1
+    return {
+        "float32": ("float32", "Flat"),
+        "float16": ("float16", "SQfp16"),
+        "int8": ("float16", "SQ8"),
+        "pq": ("float16", f"OPQ{m},PQ{m}"),
+    }
+
+
+def benchmark_storage(feature_matrix, queries=1000, k=50, train_size=100000):
+    """
+    Stores the feature matrix and index at each precision and reports their recall@k against exact float32 search and
+    the memory each process needs for the matrix and index
+
+    Args:
+        feature_matrix (numpy array): The normalised feature matrix
+        queries (int): The number of sampled track queries
+        k (int): The number of neighbours to compare
+        train_size (int): The number of vectors to train the quantizers on
+
+    Returns:
+        list: A report for each storage precision
+    """
+    query_vectors = sample_queries(feature_matrix, queries)
+
+    exact_index = build_faiss_index(feature_matrix, "Flat")
+    _, exact_ids = exact_index.search(query_vectors, k)
+    del exact_index
+
+    results = []
+    for storage, (matrix_dtype, index_type) in storage_types(feature_matrix.shape[1]).items():
+        matrix = np.asarray(feature_matrix).astype(matrix_dtype)
+        try:
+            index = build_faiss_index(matrix, index_type, train_size=train_size)
+        except RuntimeError as e:
+            print(f"Skipping {storage}: {e}")
+            continue
+
+        # Queries come from the stored matrix, as the app reads track vectors from it
+        ids, latencies = time_queries(index, sample_queries(matrix, queries), k)
+        matrix_mb = matrix.nbytes / 1024 ** 2
+        index_mb = faiss.serialize_index(index).nbytes / 1024 ** 2
+        results.append({
+            "storage": storage,
+            "matrix_dtype": matrix_dtype,
+            "index_type": index_type,
+            f"recall@{k}": round(recall_at_k(ids, exact_ids), 4),
+            "latency_ms_p50": round(float(np.percentile(latencies, 50)), 3),
+            "matrix_mb": round(matrix_mb, 2),
+            "index_mb": round(index_mb, 2),
+            "total_mb": round(matrix_mb + index_mb, 2),
+        })
+        print(results[-1])
+        del index, matrix
+
+    return results
+
+
+def per_row_sentiment(df, text_col):
+    """
+    The original sentiment stage, two TextBlob analyses of every row, kept as the baseline
+
+    Args:
+        df (pandas DataFrame): Tracks with a text column
+        text_col (str): The column to analyse
+
+    Returns:
+        pandas DataFrame: The tracks with subjectivity and polarity labels
+    """
+    pipeline = FeaturePipeline()
+    df.loc[:, 'subjectivity'] = df[text_col].apply(
+        lambda text: TextBlob(text).sentiment.subjectivity).apply(lambda x: pipeline.get_analysis(x, "subjectivity"))
+    df.loc[:, 'polarity'] = df[text_col].apply(
+        lambda text: TextBlob(text).sentiment.polarity).apply(pipeline.get_analysis)
+
+    return df
+
+
+def benchmark_sentiment(track_names, workers=1):
+    """
+    Reports the rows per second of the per-row sentiment baseline and of the deduplicated, single pass and
+    optionally parallel sentiment stage of the feature pipeline. SENTIMENT_EDGE_CASES are added to the track names
+
+    Args:
+        track_names (pandas Series): The track names to analyse
+        workers (int): The number of processes for the feature pipeline
+
+    Returns:
+        dict: The throughput of each implementation and whether their labels agree
+    """
+    track_names = pd.concat([track_names.fillna("").astype(str), pd.Series(SENTIMENT_EDGE_CASES)], ignore_index=True)
+
+    start = time.perf_counter()
+    baseline = per_row_sentiment(pd.DataFrame({"track_name": track_names}), "track_name")
+    baseline_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    pipeline = FeaturePipeline(workers=workers).sentiment_analysis(pd.DataFrame({"track_name": track_names}), "track_name")
+    pipeline_seconds = time.perf_counter() - start
+
+    result = {
+        "rows": len(track_names),
+        "unique_names": int(track_names.str.lower().nunique()),
+        "workers": workers,
+        "baseline_rows_per_second": round(len(track_names) / baseline_seconds, 1),
+        "pipeline_rows_per_second": round(len(track_names) / pipeline_seconds, 1),
+        "speedup": round(baseline_seconds / pipeline_seconds, 2),
+        "labels_match": bool((baseline[["subjectivity", "polarity"]] == pipeline[["subjectivity", "polarity"]]).all().all()),
+    }
+    print(result)
+
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks of the recommendation pipeline")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    index_parser = subparsers.add_parser("index", help="Compare FAISS index types over the normalised feature matrix")
+    index_parser.add_argument("--index-type", action="append", dest="index_types",
+                              help="A FAISS factory string, optionally followed by search parameters after a '|', "
+                                   "e.g. 'IVF1024,Flat|nprobe=32'. Can be repeated, defaults to a standard set")
+    index_parser.add_argument("--queries", type=int, default=1000)
+    index_parser.add_argument("-k", type=int, default=50)
+    index_parser.add_argument("--train-size", type=int, default=100000)
+    index_parser.add_argument("--output", default=get_file_path("index_benchmark.json"))
+
+    storage_parser = subparsers.add_parser("storage", help="Compare the recall and memory of reduced precision storage "
+                                                           "against float32")
+    storage_parser.add_argument("--queries", type=int, default=1000)
+    storage_parser.add_argument("-k", type=int, default=50)
+    storage_parser.add_argument("--train-size", type=int, default=100000)
+    storage_parser.add_argument("--output", default=get_file_path("storage_benchmark.json"))
+
+    sentiment_parser = subparsers.add_parser("sentiment", help="Compare sentiment analysis throughput on track names")
+    sentiment_parser.add_argument("--rows", type=int, default=100000, help="The number of track names to sample")
+    sentiment_parser.add_argument("--workers", type=int, default=os.cpu_count())
+    sentiment_parser.add_argument("--output", default=get_file_path("sentiment_benchmark.json"))
+
+    args = parser.parse_args()
+
+    if args.benchmark == "index":
+        index_types = None
+        if args.index_types:
+            index_types = dict((index_type.split("|", 1) + [None])[:2] for index_type in args.index_types)
+
+        feature_matrix = np.load(get_file_path("feature_matrix_normalised.npy"), mmap_mode="r")
+        results = benchmark_index_types(feature_matrix, index_types, args.queries, args.k, args.train_size)
+
+    elif args.benchmark == "storage":
+        feature_matrix = np.load(get_file_path("feature_matrix_normalised.npy"), mmap_mode="r")
+        results = benchmark_storage(feature_matrix, args.queries, args.k, args.train_size)
+
+    else:
+        track_names = read_dataset(get_file_path("full_dataset.parquet"), columns=["track_name"])["track_name"]
+        results = benchmark_sentiment(track_names.head(args.rows), args.workers)
+
+    with open(args.output, "w") as outfile:
+        json.dump(results, outfile, indent=4)
+    print(f"Benchmark saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1766,7 +1766,10 @@ ApplicationWindow {
                                     timer.interval = 100  // Set the delay time in milliseconds
                                     timer.repeat = false
                                     timer.triggered.connect(function() {
+                                        listView.searchQuery = searchTextInput.text
+                                        listView.searchPage = 0
                                         listView.model = backend.search(searchTextInput.text)
+                                        listView.searchTotal = backend.search_total()
                                         loadingIndicator.visible = false
                                         dimOverlay.visible = false
                                     })
@@ -1805,6 +1808,49 @@ ApplicationWindow {
                             clip: true
                             focus: true
 
+                            // Artist and genre searches are loaded a page at a time
+                            property string searchQuery: ""
+                            property int searchPage: 0
+                            property int searchTotal: 0
+
+                            footer: Item {
+                                width: ListView.view.width
+                                height: listView.count < listView.searchTotal ? 60 : 0
+                                visible: listView.count < listView.searchTotal
+
+                                Button {
+                                    text: "Load more"
+                                    anchors.centerIn: parent
+                                    display: AbstractButton.TextOnly
+                                    background: null
+
+                                    contentItem: Text {
+                                        text: parent.text
+                                        color: "white"
+                                        font.pixelSize: 18
+                                        horizontalAlignment: Text.AlignHCenter
+                                        verticalAlignment: Text.AlignVCenter
+                                        font.weight: Font.DemiBold
+                                    }
+                                    onClicked: {
+                                        loadingIndicator.visible = true
+                                        dimOverlay.visible = true
+                                        var timer = Qt.createQmlObject('import QtQuick 2.0; Timer {}', parent, 'dynamicTimer')
+                                        timer.interval = 100  // Set the delay time in milliseconds
+                                        timer.repeat = false
+                                        timer.triggered.connect(function() {
+                                            var previousCount = listView.count
+                                            listView.searchPage += 1
+                                            listView.model = listView.model.concat(backend.search_page(listView.searchQuery, listView.searchPage))
+                                            listView.positionViewAtIndex(previousCount, ListView.Beginning)
+                                            loadingIndicator.visible = false
+                                            dimOverlay.visible = false
+                                        })
+                                        timer.start()
+                                    }
+                                }
+                            }
+
                                 
 
                             delegate: Item {
@@ -1835,6 +1881,29 @@ ApplicationWindow {
                                             source: modelData.album_cover
                                             fillMode: Image.PreserveAspectFit
                                         }
+
+                                        // Tapping a cover lists more tracks like it
+                                        MouseArea {
+                                            anchors.fill: parent
+                                            onClicked: {
+                                                loadingIndicator.visible = true
+                                                dimOverlay.visible = true
+                                                var trackUri = modelData.track_uri
+                                                var timer = Qt.createQmlObject('import QtQuick 2.0; Timer {}', listView, 'dynamicTimer')
+                                                timer.interval = 100  // Set the delay time in milliseconds
+                                                timer.repeat = false
+                                                timer.triggered.connect(function() {
+                                                    listView.searchQuery = ""
+                                                    listView.searchPage = 0
+                                                    listView.searchTotal = 0
+                                                    listView.model = backend.more_like_this(trackUri)
+                                                    listView.positionViewAtBeginning()
+                                                    loadingIndicator.visible = false
+                                                    dimOverlay.visible = false
+                                                })
+                                                timer.start()
+                                            }
+                                        }
                                     }
 
                                     Text {
@@ -2391,12 +2460,12 @@ ApplicationWindow {
                         Platform.FileDialog {
                             id: fileDialog
                             title: "Select Spotify Dataset File"
-                            nameFilters: ["CSV files (*.csv)"]
+                            nameFilters: ["Dataset files (*.parquet *.csv)"]
                             
                             
                             onAccepted: {
                                 backend.get_spotify_dataset_audio_features(fileDialog.file)
-                                messageDialog.text = "Audio Features Retrieved to audio_features.csv"
+                                messageDialog.text = "Audio Features Retrieved to audio_features.parquet"
                                 messageDialog.open()
                             }
                         }
@@ -2430,7 +2499,7 @@ ApplicationWindow {
                             id: selectDatasetAndAudioFeaturesDialog
                             title: "Select Spotify Dataset and Audio Features Files"
                             fileMode: Platform.FileDialog.OpenFiles
-                            nameFilters: ["CSV files (*.csv)"]
+                            nameFilters: ["Dataset files (*.parquet *.csv)"]
                             
                             onAccepted: {
                                 loadingIndicator.visible = true
@@ -2460,6 +2529,42 @@ ApplicationWindow {
                             }
                         }
                     }
+
+                    Rectangle {
+                        id: buildNeighbourGraphRect
+                        color: "white"
+                        radius: 10
+                        width: parent.width * 0.85
+                        height: parent.height * 0.1
+
+                        anchors.top: createFullDatasetRect.bottom
+                        anchors.topMargin: parent.height * 0.05
+
+                        anchors.horizontalCenter: parent.horizontalCenter
+
+                        Button {
+                            id: buildNeighbourGraphButton
+                            text: "Build Neighbour Graph"
+
+                            anchors.fill: parent
+
+                            onClicked: {
+                                loadingIndicator.visible = true
+                                dimOverlay.visible = true
+                                var timer = Qt.createQmlObject('import QtQuick 2.0; Timer {}', parent, 'dynamicTimer')
+                                timer.interval = 100  // Set the delay time in milliseconds
+                                timer.repeat = false
+                                timer.triggered.connect(function() {
+                                    backend.build_neighbour_graph()
+                                    loadingIndicator.visible = false
+                                    dimOverlay.visible = false
+                                    dialogMessage.text = "Neighbour Graph Built"
+                                    messageDialog.open()
+                                })
+                                timer.start()
+                            }
+                        }
+                    }
                 }
             }
         }
@@ -1,22 +1,38 @@
+import csv
+import functools
+import heapq
 import json
 import random
+import re
 import time
 import os
+import bisect
+import pickle
+import shutil
+import tempfile
+import threading
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
 import numpy as np
 
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
 import psutil
+import requests
 import ast
 from textblob import TextBlob
 from sklearn.preprocessing import MinMaxScaler
 from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.decomposition import TruncatedSVD
+from sklearn.decomposition import TruncatedSVD, IncrementalPCA
 import faiss
 import sqlite3
 from sqlite3 import Error
 
 import bcrypt
-from collections import Counter
+from collections import Counter, defaultdict, deque
 
 import spotipy
 from spotipy.oauth2 import SpotifyClientCredentials, SpotifyOAuth
@@ -33,16 +49,759 @@ def get_file_path(filename):
 
     return os.path.join(base_path, filename)
 
+
+DATASET_COLUMNS = ['artist_name', 'track_uri', 'artist_uri', 'track_name']
+
+
+def parse_genres(genres):
+    """
+    Convert a genres value to a list of genres. Genres are stored as list columns in parquet files and as
+    stringified python lists in csv files.
+
+    Args:
+        genres: The genres value of a track
+
+    Returns:
+        list: The genres of the track
+    """
+    if isinstance(genres, str):
+        try:
+            return list(ast.literal_eval(genres))
+        except (ValueError, SyntaxError):
+            return []
+
+    if isinstance(genres, (list, tuple, np.ndarray)):
+        return list(genres)
+
+    return []
+
+
+def read_dataset(file_path, columns=None):
+    """
+    Reads a dataset file, loading only the given columns. Falls back to the csv file of the same name if the
+    parquet file has not been created yet.
+
+    Args:
+        file_path (str): Path to the parquet file
+        columns (list): The columns to load, None loads every column
+
+    Returns:
+        pandas DataFrame: The dataset
+    """
+    if file_path.endswith(".parquet") and not os.path.exists(file_path):
+        csv_file = file_path[:-len(".parquet")] + ".csv"
+        if os.path.exists(csv_file):
+            file_path = csv_file
+
+    if file_path.endswith(".parquet"):
+        return pd.read_parquet(file_path, columns=columns)
+
+    return pd.read_csv(file_path, engine="pyarrow", usecols=columns)
+
+
+AUDIO_FEATURES_SCHEMA = pa.schema([
+    ("track_uri", pa.string()),
+    ("artist_pop", pa.float64()),
+    ("genres", pa.list_(pa.string())),
+    ("danceability", pa.float64()),
+    ("energy", pa.float64()),
+    ("key", pa.float64()),
+    ("loudness", pa.float64()),
+    ("mode", pa.float64()),
+    ("speechiness", pa.float64()),
+    ("acousticness", pa.float64()),
+    ("instrumentalness", pa.float64()),
+    ("liveness", pa.float64()),
+    ("valence", pa.float64()),
+    ("tempo", pa.float64()),
+    ("track_pop", pa.float64()),
+])
+
+
+def dataset_columns(file_path):
+    """
+    Gets the column names of a dataset file without reading its rows
+
+    Args:
+        file_path (str): Path to the parquet file, falls back to the csv file of the same name
+
+    Returns:
+        list: The column names
+    """
+    if file_path.endswith(".parquet"):
+        if os.path.exists(file_path):
+            return pq.read_schema(file_path).names
+        file_path = file_path[:-len(".parquet")] + ".csv"
+
+    return list(pd.read_csv(file_path, nrows=0).columns)
+
+
+def count_rows(file_path):
+    """
+    Counts the rows of a dataset file, reading only the parquet metadata when possible
+
+    Args:
+        file_path (str): Path to the parquet file, falls back to the csv file of the same name
+
+    Returns:
+        int: The number of rows in the dataset
+    """
+    if file_path.endswith(".parquet") and os.path.exists(file_path):
+        return pq.ParquetFile(file_path).metadata.num_rows
+
+    return len(read_dataset(file_path, columns=["track_uri"]))
+
+
+def iter_dataset(file_path, columns, batch_size, start=0):
+    """
+    Reads a dataset file in batches of a fixed number of rows without loading the whole file
+
+    Args:
+        file_path (str): Path to the parquet file, falls back to the csv file of the same name
+        columns (list): The columns to load
+        batch_size (int): The number of rows in each batch, only the last batch can be smaller
+        start (int): The row to start reading from
+
+    Yields:
+        tuple: The row number of the first row in the batch and the batch as a pandas DataFrame
+    """
+    if file_path.endswith(".parquet") and not os.path.exists(file_path):
+        file_path = file_path[:-len(".parquet")] + ".csv"
+
+    if not file_path.endswith(".parquet"):
+        chunks = pd.read_csv(file_path, usecols=columns, chunksize=batch_size,
+                             skiprows=lambda row: 0 < row <= start)
+        for offset, chunk in enumerate(chunks):
+            # pandas yields a single empty chunk when every row is skipped
+            if chunk.empty:
+                return
+            yield start + offset * batch_size, chunk.reset_index(drop=True)
+        return
+
+    parquet_file = pq.ParquetFile(file_path)
+
+    # Skip whole row groups that come before the start row
+    row_groups = []
+    position = 0
+    for i in range(parquet_file.num_row_groups):
+        num_rows = parquet_file.metadata.row_group(i).num_rows
+        if position + num_rows > start or row_groups:
+            row_groups.append(i)
+        else:
+            position += num_rows
+
+    if not row_groups:
+        return
+
+    buffer = pa.Table.from_batches([], schema=parquet_file.schema_arrow).select(columns)
+    for record_batch in parquet_file.iter_batches(batch_size=batch_size, row_groups=row_groups, columns=columns):
+        if position < start:
+            skip = min(start - position, record_batch.num_rows)
+            record_batch = record_batch.slice(skip)
+            position += skip
+
+        buffer = pa.concat_tables([buffer, pa.Table.from_batches([record_batch])])
+        while buffer.num_rows >= batch_size:
+            yield position, buffer.slice(0, batch_size).to_pandas()
+            buffer = buffer.slice(batch_size)
+            position += batch_size
+
+    if buffer.num_rows:
+        yield position, buffer.to_pandas()
+
+
+def write_dataset(df, file_path, schema=None):
+    """
+    Writes a dataset to a zstd compressed parquet file, storing genres as a list of strings column
+
+    Args:
+        df (pandas DataFrame): The dataset
+        file_path (str): Path to the parquet file
+        schema (pyarrow Schema): The columns and types to write, None keeps the types of the DataFrame
+    """
+    if "genres" in df.columns:
+        df = df.assign(genres=df["genres"].apply(parse_genres))
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+
+    if "genres" in table.column_names:
+        genres = table["genres"].cast(pa.list_(pa.string()))
+        table = table.set_column(table.column_names.index("genres"), "genres", genres)
+
+    if schema is not None:
+        table = table.select(schema.names).cast(schema)
+
+    pq.write_table(table, file_path, compression="zstd")
+
+
+def append_npy_rows(file_path, rows):
+    """
+    Appends rows to a 2D .npy file in place by rewriting its header and writing the rows at the end of the file.
+    numpy pads .npy headers so the first dimension can grow, the whole file is only rewritten if the header
+    would not fit.
+
+    Args:
+        file_path (str): Path to the .npy file
+        rows (numpy array): The rows to append
+    """
+    with open(file_path, "r+b") as npy_file:
+        version = np.lib.format.read_magic(npy_file)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(npy_file)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(npy_file)
+        header_length = npy_file.tell()
+
+        header = {"descr": np.lib.format.dtype_to_descr(dtype), "fortran_order": fortran_order,
+                  "shape": (shape[0] + len(rows),) + tuple(shape[1:])}
+        npy_file.seek(0)
+        if version == (1, 0):
+            np.lib.format.write_array_header_1_0(npy_file, header)
+        else:
+            np.lib.format.write_array_header_2_0(npy_file, header)
+
+        if npy_file.tell() == header_length and not fortran_order:
+            npy_file.seek(0, os.SEEK_END)
+            npy_file.write(np.ascontiguousarray(rows, dtype=dtype).tobytes())
+            return
+
+        # The header grew, restore it and rewrite the file
+        npy_file.seek(0)
+        header["shape"] = shape
+        if version == (1, 0):
+            np.lib.format.write_array_header_1_0(npy_file, header)
+        else:
+            np.lib.format.write_array_header_2_0(npy_file, header)
+
+    # Write a new file rather than truncating one that other processes may have memory-mapped
+    np.save(file_path + ".tmp.npy", np.concatenate([np.load(file_path, mmap_mode="r"), rows.astype(dtype)]))
+    os.replace(file_path + ".tmp.npy", file_path)
+
+
+def iter_playlists(file_path, chunk_size=1 << 20):
+    """
+    Incrementally parse the playlists of a Million Playlist Dataset slice file without loading the whole file
+
+    Args:
+        file_path (str): Path to the json file containing the playlist data
+        chunk_size (int): The number of characters to read from the file at a time
+
+    Yields:
+        dict: One playlist at a time
+    """
+    decoder = json.JSONDecoder()
+    separators = re.compile(r"[\s,]*")
+
+    with open(file_path, "r", encoding="utf-8") as infile:
+        buffer = ""
+
+        # Skip ahead to the opening bracket of the playlists array
+        while True:
+            key = buffer.find('"playlists"')
+            bracket = buffer.find("[", key) if key != -1 else -1
+            if bracket != -1:
+                buffer = buffer[bracket + 1:]
+                break
+
+            chunk = infile.read(chunk_size)
+            if not chunk:
+                return
+            buffer += chunk
+
+        position = 0
+        while True:
+            position = separators.match(buffer, position).end()
+
+            if position < len(buffer) and buffer[position] == "]":
+                return
+
+            try:
+                playlist, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # The next playlist is only partially buffered, read more of the file
+                chunk = infile.read(chunk_size)
+                if not chunk:
+                    raise
+                buffer = buffer[position:] + chunk
+                position = 0
+                continue
+
+            yield playlist
+
+
+def iter_slice_tracks(file_path):
+    """
+    Stream the tracks of a slice file, keeping only the dataset columns
+
+    Args:
+        file_path (str): Path to the json file containing the playlist data
+
+    Yields:
+        dict: The artist_name, track_uri, artist_uri and track_name of each track
+    """
+    for playlist in iter_playlists(file_path):
+        for track in playlist['tracks']:
+            yield {column: track.get(column) for column in DATASET_COLUMNS}
+
+
+def clean_slice(file_path, output_dir):
+    """
+    Parses a single slice file, removes its duplicate tracks and writes them to a partial csv file.
+    Runs inside a worker process when the dataset is cleaned in parallel.
+
+    Args:
+        file_path (str): Path to the json file containing the playlist data
+        output_dir (str): Directory to write the partial csv file to
+
+    Returns:
+        tuple: The partial csv file path, the worker process id and the number of tracks written
+    """
+    df = pd.DataFrame(list(iter_slice_tracks(file_path)), columns=DATASET_COLUMNS)
+    df.drop_duplicates(subset=["track_uri"], ignore_index=True, inplace=True)
+
+    partial_file = os.path.join(output_dir, os.path.basename(file_path) + ".csv")
+    df.to_csv(partial_file, index=False, header=False)
+
+    return partial_file, os.getpid(), len(df)
+
+
+def score_sentiments(texts):
+    """
+    Scores the polarity and subjectivity of each text with a single TextBlob analysis.
+    Runs inside a worker process when track names are analysed in parallel.
+
+    Args:
+        texts (list): The texts to score
+
+    Returns:
+        list: The (polarity, subjectivity) of each text
+    """
+    return [tuple(TextBlob(text).sentiment) for text in texts]
+
+
+class PipelineMetrics:
+    """
+    Records wall time, CPU time, throughput, I/O, Spotify API latency and peak memory for each stage of the
+    dataset pipeline and writes them to a json report
+    """
+    REPORT_FILE = get_file_path("pipeline_metrics.json")
+
+    def __init__(self, sample_interval=0.1):
+        """
+        Args:
+            sample_interval (float): The number of seconds between memory samples while a stage runs
+        """
+        self.sample_interval = sample_interval
+        self.process = psutil.Process()
+        self.lock = threading.Lock()
+        self.current = None
+
+    def io_counters(self):
+        """
+        Returns:
+            tuple: The number of bytes this process has read and written so far, zeros where not supported
+        """
+        try:
+            io = self.process.io_counters()
+        except (AttributeError, psutil.Error):
+            return 0, 0
+
+        return getattr(io, "read_chars", io.read_bytes), getattr(io, "write_chars", io.write_bytes)
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Measures the code run inside the with block as one pipeline stage and saves its metrics to the report
+
+        Args:
+            name (str): The name of the stage
+        """
+        previous = self.current
+        self.current = {"rows": 0, "api_latencies": []}
+        peak_rss = [self.process.memory_info().rss]
+        stop = threading.Event()
+
+        def sample_memory():
+            while not stop.wait(self.sample_interval):
+                peak_rss[0] = max(peak_rss[0], self.process.memory_info().rss)
+
+        sampler = threading.Thread(target=sample_memory, daemon=True)
+        read_start, written_start = self.io_counters()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        sampler.start()
+
+        try:
+            yield
+        finally:
+            wall_seconds = time.perf_counter() - wall_start
+            cpu_seconds = time.process_time() - cpu_start
+            stop.set()
+            sampler.join()
+            read_end, written_end = self.io_counters()
+            stage, self.current = self.current, previous
+
+            latencies = np.array(stage["api_latencies"]) * 1000
+            metrics = {
+                "wall_seconds": round(wall_seconds, 3),
+                "cpu_seconds": round(cpu_seconds, 3),
+                "wait_seconds": round(max(wall_seconds - cpu_seconds, 0), 3),
+                "rows": stage["rows"],
+                "rows_per_second": round(stage["rows"] / wall_seconds, 1) if wall_seconds else None,
+                "bytes_read": read_end - read_start,
+                "bytes_written": written_end - written_start,
+                "api_calls": len(latencies),
+                "api_latency_ms": {
+                    "p50": round(float(np.percentile(latencies, 50)), 1),
+                    "p90": round(float(np.percentile(latencies, 90)), 1),
+                    "p99": round(float(np.percentile(latencies, 99)), 1),
+                    "max": round(float(latencies.max()), 1),
+                } if len(latencies) else None,
+                "peak_rss_mb": round(max(peak_rss[0], self.process.memory_info().rss) / 1e6, 1),
+                "finished_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            }
+            self.write_report(name, metrics)
+            print(f"{name}: {metrics['wall_seconds']}s wall, {metrics['cpu_seconds']}s cpu, "
+                  f"{metrics['rows']} rows ({metrics['rows_per_second']} rows/s), {metrics['api_calls']} API calls, "
+                  f"{metrics['peak_rss_mb']} MB peak RSS")
+
+    def add_rows(self, rows):
+        """
+        Adds to the number of rows processed by the running stage
+
+        Args:
+            rows (int): The number of rows processed
+        """
+        with self.lock:
+            if self.current is not None:
+                self.current["rows"] += rows
+
+    def record_api_call(self, latency):
+        """
+        Records the latency of a Spotify API call made by the running stage
+
+        Args:
+            latency (float): The number of seconds the call took
+        """
+        with self.lock:
+            if self.current is not None:
+                self.current["api_latencies"].append(latency)
+
+    def write_report(self, name, metrics):
+        """
+        Saves the metrics of a stage to the report file, keeping the latest metrics of the other stages
+
+        Args:
+            name (str): The name of the stage
+            metrics (dict): The metrics of the stage
+        """
+        report = {}
+        if os.path.exists(self.REPORT_FILE):
+            with open(self.REPORT_FILE, "r") as infile:
+                report = json.load(infile)
+
+        report.setdefault("stages", {})[name] = metrics
+
+        temp_file = self.REPORT_FILE + ".tmp"
+        with open(temp_file, "w") as outfile:
+            json.dump(report, outfile, indent=4)
+        os.replace(temp_file, self.REPORT_FILE)
+
+
+def pipeline_stage(name):
+    """
+    Decorator that measures a method as a pipeline stage using the metrics of its class
+
+    Args:
+        name (str): The name of the stage
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self.metrics.stage(name):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class RateLimiter:
+    """
+    Token bucket shared by every thread that calls the Spotify API
+    """
+
+    def __init__(self, rate, capacity=None):
+        """
+        Args:
+            rate (float): The number of requests allowed per second
+            capacity (int): The largest burst of requests allowed at once, defaults to one second of requests
+        """
+        self.rate = rate
+        self.capacity = capacity or max(1, int(rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Blocks until a request is allowed to be sent
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                elif self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                else:
+                    wait = (1 - self.tokens) / self.rate
+
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """
+        Stops every thread from sending requests for a number of seconds, used when the API returns a 429
+
+        Args:
+            seconds (float): The number of seconds to wait
+        """
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0
+
+
+class ResponseCache:
+    """
+    On-disk cache of Spotify API responses keyed by endpoint and URI, shared by every class that calls the API
+    """
+    CACHE_FILE = get_file_path("spotify_cache.db")
+    # Fields of each endpoint's responses that are read, the rest are dropped before caching. Artists are only read
+    # through the first artist of a track
+    RESPONSE_FIELDS = {
+        "tracks": ["uri", "name", "popularity", "artists"],
+        "artists": ["popularity", "genres"],
+        "audio_features": ["danceability", "energy", "key", "loudness", "mode", "speechiness", "acousticness",
+                           "instrumentalness", "liveness", "valence", "tempo"],
+    }
+    ARTIST_FIELDS = ["uri", "name"]
+
+    def __init__(self, ttl=7 * 24 * 60 * 60, max_entries=6000000):
+        """
+        Args:
+            ttl (int): The number of seconds a response stays valid for
+            max_entries (int): The number of responses kept before the least recently used are evicted, the default
+                holds the tracks, audio features and artists of the full Million Playlist Dataset (about 2.26M tracks
+                and 300k artists) so a rerun of the enrichment is served from the cache
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.rows = 0
+        self.lock = threading.Lock()
+        self.create_table()
+
+    def create_connection(self):
+        connection = None
+        try:
+            connection = sqlite3.connect(self.CACHE_FILE, timeout=30)
+            return connection
+
+        except Error as e:
+            print(e)
+
+        return connection
+
+    def create_table(self):
+        connection = self.create_connection()
+        if connection is not None:
+            try:
+                cursor = connection.cursor()
+                cursor.execute("PRAGMA journal_mode=WAL;")
+                cursor.execute('''CREATE TABLE IF NOT EXISTS responses (
+                                    endpoint TEXT NOT NULL,
+                                    uri TEXT NOT NULL,
+                                    response TEXT,
+                                    fetched_at REAL NOT NULL,
+                                    accessed_at REAL NOT NULL,
+                                    PRIMARY KEY (endpoint, uri)
+                                );''')
+                cursor.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at);")
+                connection.commit()
+
+                # Counted once, set_many keeps the count up to date instead of scanning the table on every write
+                cursor.execute("SELECT COUNT(*) FROM responses")
+                self.rows = cursor.fetchone()[0]
+            except Error as e:
+                print(e)
+
+            finally:
+                connection.close()
+
+    def get_many(self, endpoint, uris):
+        """
+        Looks up the cached responses of an endpoint that have not expired
+
+        Args:
+            endpoint (str): The name of the endpoint
+            uris (list): The URIs to look up
+
+        Returns:
+            dict: The cached response of each URI found
+        """
+        responses = {}
+        connection = self.create_connection()
+        if connection is not None:
+            try:
+                cursor = connection.cursor()
+                now = time.time()
+
+                for i in range(0, len(uris), 500):  # stay under the sqlite variable limit
+                    batch = uris[i:i + 500]
+                    cursor.execute('''
+                        SELECT uri, response FROM responses
+                        WHERE endpoint = ? AND fetched_at >= ? AND uri IN ({seq})
+                    '''.format(seq=','.join(['?'] * len(batch))), (endpoint, now - self.ttl, *batch))
+                    responses.update({uri: json.loads(response) for uri, response in cursor.fetchall()})
+
+                cursor.executemany("UPDATE responses SET accessed_at = ? WHERE endpoint = ? AND uri = ?",
+                                   [(now, endpoint, uri) for uri in responses])
+                connection.commit()
+            except Error as e:
+                print(e)
+            finally:
+                connection.close()
+
+        return responses
+
+    def slim_response(self, endpoint, response):
+        """
+        Keeps only the fields of a response that are read, see RESPONSE_FIELDS
+
+        Args:
+            endpoint (str): The name of the endpoint
+            response (dict): The response of a URI, None if Spotify has no record of it
+
+        Returns:
+            dict: The response with only the fields that are read, unchanged for endpoints not in RESPONSE_FIELDS
+        """
+        fields = self.RESPONSE_FIELDS.get(endpoint)
+        if response is None or fields is None:
+            return response
+
+        response = {field: response.get(field) for field in fields}
+        if response.get("artists"):
+            response["artists"] = [{field: response["artists"][0].get(field) for field in self.ARTIST_FIELDS}]
+        return response
+
+    def set_many(self, endpoint, responses):
+        """
+        Saves responses of an endpoint and evicts the least recently used responses when the cache is full
+
+        Args:
+            endpoint (str): The name of the endpoint
+            responses (dict): The response of each URI
+        """
+        connection = self.create_connection()
+        if connection is not None:
+            try:
+                cursor = connection.cursor()
+                now = time.time()
+                uris = list(responses)
+
+                # Only URIs that are not cached yet add a row
+                cached = 0
+                for i in range(0, len(uris), 500):  # stay under the sqlite variable limit
+                    batch = uris[i:i + 500]
+                    cursor.execute('''
+                        SELECT COUNT(*) FROM responses WHERE endpoint = ? AND uri IN ({seq})
+                    '''.format(seq=','.join(['?'] * len(batch))), (endpoint, *batch))
+                    cached += cursor.fetchone()[0]
+
+                cursor.executemany('''
+                    INSERT OR REPLACE INTO responses (endpoint, uri, response, fetched_at, accessed_at)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', [(endpoint, uri, json.dumps(response), now, now) for uri, response in responses.items()])
+
+                with self.lock:
+                    self.rows += len(uris) - cached
+                    excess = self.rows - self.max_entries
+                if excess > 0:
+                    cursor.execute('''
+                        DELETE FROM responses WHERE rowid IN (
+                            SELECT rowid FROM responses ORDER BY accessed_at LIMIT ?
+                        )
+                    ''', (excess,))
+                    with self.lock:
+                        self.rows -= cursor.rowcount
+                connection.commit()
+            except Error as e:
+                print(e)
+            finally:
+                connection.close()
+
+    def fetch(self, endpoint, uris, fetch_batch, batch_size):
+        """
+        Gets the response of each URI from the cache, fetching only the URIs that are missing or expired
+
+        Args:
+            endpoint (str): The name of the endpoint
+            uris (list): The URIs to get responses for
+            fetch_batch (function): Fetches the responses of a list of URIs from the API, in the same order
+            batch_size (int): The largest number of URIs the endpoint accepts at once
+
+        Returns:
+            list: The response of each URI, in the same order as the URIs
+        """
+        uris = list(uris)
+        responses = self.get_many(endpoint, list(dict.fromkeys(uris)))
+        missing = [uri for uri in dict.fromkeys(uris) if uri not in responses]
+
+        cached = sum(uri in responses for uri in uris)
+        with self.lock:
+            self.hits += cached
+            self.misses += len(uris) - cached
+
+        for i in range(0, len(missing), batch_size):
+            batch = missing[i:i + batch_size]
+            fetched = {uri: self.slim_response(endpoint, response) for uri, response in zip(batch, fetch_batch(batch))}
+            self.set_many(endpoint, fetched)
+            responses.update(fetched)
+
+        return [responses[uri] for uri in uris]
+
+    def stats(self):
+        """
+        Returns:
+            dict: The number of cache hits and misses so far and the number of cached responses
+        """
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": self.rows}
+
+
 class SpotifyDatasetProcessor:
-    def __init__(self, client_id, client_secret):
+    def __init__(self, client_id, client_secret, requests_per_second=10, workers=8, cache=None, metrics=None):
         """
         :param directory: Directory containing the spotify dataset json files
+        :param requests_per_second: The number of Spotify API requests allowed per second across all threads
+        :param workers: The number of threads fetching metadata from the Spotify API at once
+        :param cache: The Spotify API response cache, a new one is created if not given
+        :param metrics: The pipeline metrics recorder, a new one is created if not given
         """
         self.directory = ""
         self.csv_file = get_file_path("dataset.csv")
-        self.audio_features_file = get_file_path("audio_features.csv")
+        self.dataset_file = get_file_path("dataset.parquet")
+        self.audio_features_file = get_file_path("audio_features.parquet")
         self.client_id = client_id
         self.client_secret = client_secret
+        self.rate_limiter = RateLimiter(requests_per_second)
+        self.workers = workers
+        self.cache = cache or ResponseCache()
+        self.metrics = metrics or PipelineMetrics()
         self.sp = self.create_spotify_client()
         
 
@@ -51,7 +810,7 @@ class SpotifyDatasetProcessor:
         Creates an empty csv file with the columns: artist_name, track_uri, artist_uri, track_name
         """
         if not os.path.exists(self.csv_file):
-            columns = ['artist_name', 'track_uri', "artist_uri", 'track_name']
+            columns = DATASET_COLUMNS
             df = pd.DataFrame(columns=columns)
             df.to_csv(self.csv_file, index=False)
             print(f"{self.csv_file} created with columns: {', '.join(columns)}")
@@ -74,93 +833,285 @@ class SpotifyDatasetProcessor:
 
         return track_data
 
-    def clean_data(self):
+    def write_tracks_batch(self, tracks_list):
         """
-        Cleans the spotify dataset given and writes it to a csv file
+        Removes duplicate tracks from a batch of tracks and appends the batch to the dataset csv file
+
+        Args:
+            tracks_list (list): A list of track dictionaries with the dataset columns
         """
-        time_start = time.process_time()
-        tracks_list = []
-        self.create_empty_csv()
+        df = pd.DataFrame(tracks_list, columns=DATASET_COLUMNS)
+        df.drop_duplicates(subset=["track_uri"], ignore_index=True, inplace=True)
+        df.to_csv(self.csv_file, mode="a", index=False, header=False)
 
-        for file in self.directory:
-            track_data = self.get_all_tracks_info(file)
-            tracks_list.extend(track_data)
+    def stream_tracks(self, batch_size=100000):
+        """
+        Streams the tracks of every slice file in the directory and appends them to the dataset csv file in
+        fixed size batches, so peak memory stays the same however many slice files are processed
 
-            if int(psutil.virtual_memory().available / 1000000000) <= 3:
-                df = pd.DataFrame(tracks_list)
-                df.drop(columns=["pos", "duration_ms",
-                        "album_name", "album_uri"], inplace=True)
-                df.drop_duplicates(
-                    subset=["track_uri"], ignore_index=True, inplace=True)
-                df.to_csv(get_file_path("dataset.csv"), mode="a",
-                          index=False, header=False)
-                tracks_list.clear()
+        Args:
+            batch_size (int): The number of tracks to hold in memory before writing them to disk
+        """
+        tracks_list = []
 
-            percentage_complete = (
-                ((int(self.directory.index(file) + 1)) / 1000) * 100)
+        for file_number, file in enumerate(self.directory, start=1):
+            for track in iter_slice_tracks(file):
+                tracks_list.append(track)
 
+                if len(tracks_list) >= batch_size:
+                    self.write_tracks_batch(tracks_list)
+                    tracks_list.clear()
+
+            percentage_complete = (file_number / len(self.directory)) * 100
             print(f"{'{:.2f}'.format(percentage_complete)}% completed")
 
         if tracks_list:
-            df = pd.DataFrame(tracks_list)
-            df.drop(columns=["pos", "duration_ms",
-                    "album_name", "album_uri"], inplace=True)
-            df.drop_duplicates(subset=["track_uri"],
-                               ignore_index=True, inplace=True)
+            self.write_tracks_batch(tracks_list)
 
-            df.to_csv(get_file_path("dataset.csv"), mode="a", index=False, header=False)
+    def parallel_clean(self, workers):
+        """
+        Parses and removes duplicates from the slice files in a pool of worker processes, then appends each
+        worker's partial csv file to the dataset csv file
 
-        df = pd.read_csv(get_file_path("dataset.csv"))
-        df.drop_duplicates(subset=["track_uri"],
-                           ignore_index=True, inplace=True)
-        df = df.sort_values(
-            by=['track_name', 'artist_name'], ignore_index=True)
-        df.to_csv(self.csv_file, mode="w", index=False)
+        Args:
+            workers (int): The number of worker processes to use
+        """
+        partial_dir = tempfile.mkdtemp(dir=os.path.dirname(self.csv_file))
 
-        time_taken = time.process_time() - time_start
-        print(f"Time taken: {time_taken} seconds")
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(clean_slice, file, partial_dir) for file in self.directory]
 
-    def create_spotify_client(self):
+                with open(self.csv_file, "ab") as outfile:
+                    for file_number, future in enumerate(as_completed(futures), start=1):
+                        partial_file, pid, rows = future.result()
+
+                        with open(partial_file, "rb") as infile:
+                            shutil.copyfileobj(infile, outfile)
+                        os.remove(partial_file)
+
+                        percentage_complete = (file_number / len(self.directory)) * 100
+                        print(f"Worker {pid}: {os.path.basename(partial_file)} ({rows} tracks) - "
+                              f"{'{:.2f}'.format(percentage_complete)}% completed")
+        finally:
+            shutil.rmtree(partial_dir, ignore_errors=True)
+
+    @pipeline_stage("clean_data")
+    def clean_data(self, streaming=True, batch_size=100000, workers=1):
         """
-        Creates a Spotify client using the SpotifyClientCredentials manager.
+        Cleans the spotify dataset given and writes it to a csv file
+
+        Args:
+            streaming (bool): Parse the slice files incrementally and write the tracks in fixed size batches
+            batch_size (int): The number of tracks written per batch when streaming
+            workers (int): The number of worker processes to parse the slice files with, 1 parses them in this process
         """
-        credentials_manager = SpotifyClientCredentials(
-            client_id=self.client_id, client_secret=self.client_secret)
-        return spotipy.Spotify(auth_manager=credentials_manager)
+        self.create_empty_csv()
 
-    def spotify_call(self, func, *args, retries=3):
+        if workers > 1:
+            self.parallel_clean(workers)
+        elif streaming:
+            self.stream_tracks(batch_size)
+        else:
+            self.load_tracks()
+
+        self.deduplicate_and_sort()
+        self.convert_to_parquet()
+        self.metrics.add_rows(count_rows(self.dataset_file))
+
+    def partition_dataset(self, partition_dir, partitions, chunk_size):
         """
-        Try a Spotify API call a specified number of times.
+        Splits the dataset csv file into partition files by the hash of each track URI, so every copy of a track
+        ends up in the same partition
 
         Args:
-            func (function): The Spotify API function to call
-            retries (int): The number of retries to attempt
+            partition_dir (str): Directory to write the partition files to
+            partitions (int): The number of partition files to split the dataset into
+            chunk_size (int): The number of rows to read from the dataset csv file at a time
 
         Returns:
-            The result of the Spotify API call
+            list: The paths of the partition files
         """
+        partition_files = [os.path.join(partition_dir, f"partition_{i}.csv") for i in range(partitions)]
 
-        for attempt in range(retries):
-            try:
-                return func(*args)
-            except spotipy.exceptions.SpotifyException as e:
-                if e.http_status == 401:
-                    print(f"401 Unauthorized. Attempt {
-                          attempt + 1}/{retries}. Reinitializing client...")
-                    self.sp = self.create_spotify_client()  # Reinitialize the client
-                else:
-                    print(f"SpotifyException: {e}")
-                    raise
+        for chunk in pd.read_csv(self.csv_file, dtype=str, keep_default_na=False, chunksize=chunk_size):
+            partition_ids = pd.util.hash_pandas_object(chunk["track_uri"], index=False) % partitions
 
-    def process_batch(self, batch):
+            for partition_id, partition in chunk.groupby(partition_ids.values):
+                partition.to_csv(partition_files[partition_id], mode="a", index=False, header=False)
+
+        return [file for file in partition_files if os.path.exists(file)]
+
+    def sort_key(self, row):
         """
-        Extracts audio features for each track in the batch and returns a dataframe with the following columns:
-        - artist_pop: The popularity of the artist
-        - genres: The genres of the artist
-        - danceability: The danceability of the track from 9 to 1
-        - energy: The energy of the track
-        - key: The key of the track
-        - loudness: The loudness of the track
+        Sort key for a dataset csv row that orders tracks by track name then artist name, with missing values last
+
+        Args:
+            row (list): A row of the dataset csv file
+
+        Returns:
+            tuple: The sort key of the row
+        """
+        artist_name, track_name = row[0], row[3]
+        return (track_name == "", track_name, artist_name == "", artist_name)
+
+    def read_rows(self, file_path):
+        """
+        Lazily reads the rows of a csv file without a header
+
+        Args:
+            file_path (str): Path to the csv file
+
+        Yields:
+            list: One row of the csv file at a time
+        """
+        with open(file_path, "r", encoding="utf-8", newline="") as infile:
+            yield from csv.reader(infile)
+
+    def deduplicate_and_sort(self, partitions=64, chunk_size=500000):
+        """
+        Removes duplicate tracks from the dataset csv file and sorts it by track name and artist name without loading
+        the whole file into memory. The dataset is hash partitioned by track URI so each partition can be deduplicated
+        on its own, each partition is sorted into a run file and the runs are merged back into the dataset csv file.
+
+        Args:
+            partitions (int): The number of partitions to split the dataset into, peak memory is roughly the
+                              dataset size divided by this
+            chunk_size (int): The number of rows to read from the dataset csv file at a time
+        """
+        work_dir = tempfile.mkdtemp(dir=os.path.dirname(self.csv_file))
+
+        try:
+            run_files = []
+            for partition_file in self.partition_dataset(work_dir, partitions, chunk_size):
+                partition = pd.read_csv(partition_file, names=DATASET_COLUMNS, dtype=str, keep_default_na=False)
+                partition.drop_duplicates(subset=["track_uri"], ignore_index=True, inplace=True)
+
+                rows = sorted(partition.values.tolist(), key=self.sort_key)
+                run_file = partition_file.replace("partition_", "run_")
+                with open(run_file, "w", encoding="utf-8", newline="") as outfile:
+                    csv.writer(outfile, lineterminator=os.linesep).writerows(rows)
+
+                os.remove(partition_file)
+                run_files.append(run_file)
+
+            merged_file = os.path.join(work_dir, "dataset.csv")
+            with open(merged_file, "w", encoding="utf-8", newline="") as outfile:
+                writer = csv.writer(outfile, lineterminator=os.linesep)
+                writer.writerow(DATASET_COLUMNS)
+                writer.writerows(heapq.merge(*[self.read_rows(file) for file in run_files], key=self.sort_key))
+
+            os.replace(merged_file, self.csv_file)
+
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    def convert_to_parquet(self):
+        """
+        Streams the cleaned dataset csv file into the dataset parquet file one block at a time
+        """
+        read_options = pacsv.ReadOptions(block_size=1 << 24)
+        parse_options = pacsv.ParseOptions(newlines_in_values=True)
+        convert_options = pacsv.ConvertOptions(column_types={column: pa.string() for column in DATASET_COLUMNS})
+
+        reader = pacsv.open_csv(self.csv_file, read_options=read_options,
+                                parse_options=parse_options, convert_options=convert_options)
+        with pq.ParquetWriter(self.dataset_file, reader.schema, compression="zstd") as writer:
+            for batch in reader:
+                writer.write_batch(batch)
+
+        print(f"{self.dataset_file} created")
+
+    def load_tracks(self):
+        """
+        Loads whole slice files into memory and appends the tracks to the dataset csv file when available memory runs low
+        """
+        tracks_list = []
+
+        for file in self.directory:
+            track_data = self.get_all_tracks_info(file)
+            tracks_list.extend(track_data)
+
+            if int(psutil.virtual_memory().available / 1000000000) <= 3:
+                df = pd.DataFrame(tracks_list)
+                df.drop(columns=["pos", "duration_ms",
+                        "album_name", "album_uri"], inplace=True)
+                df.drop_duplicates(
+                    subset=["track_uri"], ignore_index=True, inplace=True)
+                df.to_csv(get_file_path("dataset.csv"), mode="a",
+                          index=False, header=False)
+                tracks_list.clear()
+
+            percentage_complete = (
+                ((int(self.directory.index(file) + 1)) / 1000) * 100)
+
+            print(f"{'{:.2f}'.format(percentage_complete)}% completed")
+
+        if tracks_list:
+            df = pd.DataFrame(tracks_list)
+            df.drop(columns=["pos", "duration_ms",
+                    "album_name", "album_uri"], inplace=True)
+            df.drop_duplicates(subset=["track_uri"],
+                               ignore_index=True, inplace=True)
+
+            df.to_csv(get_file_path("dataset.csv"), mode="a", index=False, header=False)
+
+    def create_spotify_client(self):
+        """
+        Creates a Spotify client using the SpotifyClientCredentials manager.
+        """
+        credentials_manager = SpotifyClientCredentials(
+            client_id=self.client_id, client_secret=self.client_secret)
+        # urllib3 still retries a 429 that carries Retry-After, sleeping in the calling thread outside the rate limiter.
+        # A plain session never retries, so every 429 and 5xx response reaches spotify_call with its status and headers
+        return spotipy.Spotify(auth_manager=credentials_manager, requests_session=requests.Session(), retries=0)
+
+    def spotify_call(self, func, *args, retries=5):
+        """
+        Try a Spotify API call a specified number of times, waiting for the rate limiter before each attempt.
+        Rate limited (429) and server error responses are retried with exponential backoff, honouring the
+        Retry-After header when the API sends one.
+
+        Args:
+            func (function): The Spotify API function to call
+            retries (int): The number of retries to attempt
+
+        Returns:
+            The result of the Spotify API call
+        """
+
+        for attempt in range(retries):
+            self.rate_limiter.acquire()
+            call_start = time.perf_counter()
+            try:
+                return func(*args)
+            except spotipy.exceptions.SpotifyException as e:
+                if e.http_status == 401:
+                    print(f"401 Unauthorized. Attempt {
+                          attempt + 1}/{retries}. Reinitializing client...")
+                    self.sp = self.create_spotify_client()  # Reinitialize the client
+                    func = getattr(self.sp, func.__name__)
+                elif e.http_status in (429, 500, 502, 503, 504) and attempt < retries - 1:
+                    retry_after = (e.headers or {}).get("Retry-After")
+                    wait = float(retry_after) if retry_after else 2 ** attempt + random.uniform(0, 1)
+                    print(f"{e.http_status} response. Attempt {attempt + 1}/{retries}. Retrying in {wait:.1f} seconds...")
+                    self.rate_limiter.pause(wait)
+                else:
+                    print(f"SpotifyException: {e}")
+                    raise
+            finally:
+                self.metrics.record_api_call(time.perf_counter() - call_start)
+
+    def process_batch(self, batch):
+        """
+        Extracts audio features for each track in the batch and returns a dataframe with the following columns:
+        - track_uri: The URI of the track
+        - artist_pop: The popularity of the artist
+        - genres: The genres of the artist
+        - danceability: The danceability of the track from 9 to 1
+        - energy: The energy of the track
+        - key: The key of the track
+        - loudness: The loudness of the track
         - mode: The mode of the track
         - speechiness: The speechiness of the track
         - acousticness: The acousticness of the track
@@ -183,122 +1134,1490 @@ class SpotifyDatasetProcessor:
         artist_uris = batch['artist_uri']
         track_uris = batch['track_uri']
 
-        # Fetch artist information
-        artist_info_list = []
-        for i in range(0, len(artist_uris), 50):  # batch size of 50 for artist info
-            artist_info_list.extend(self.spotify_call(
-                self.sp.artists, artist_uris[i:i+50])["artists"])
+        # Fetch each unique artist once and join the information back to the tracks
+        unique_artist_uris = artist_uris.unique().tolist()
+        artist_info_list = self.cache.fetch(  # batch size of 50 for artist info
+            "artists", unique_artist_uris, lambda uris: self.spotify_call(self.sp.artists, uris)["artists"], 50)
+        artists = dict(zip(unique_artist_uris, artist_info_list))
+
+        artist_info = pd.DataFrame(
+            [{'artist_pop': artists[uri]['popularity'], 'genres': artists[uri]['genres']} for uri in artist_uris])
+
+        # Fetch track audio features
+        track_features_list = self.cache.fetch(  # batch size of 100 for audio features
+            "audio_features", track_uris, lambda uris: self.spotify_call(self.sp.audio_features, uris), 100)
+        for i, track_features in enumerate(track_features_list):
+            if track_features is None:
+                track_features_list[i] = {'danceability': None, 'energy': None, 'key': None, 'loudness': None, 'mode': None,
+                                          'speechiness': None, 'acousticness': None, 'instrumentalness': None, 'liveness': None, 'valence': None, 'tempo': None}
+            else:
+                track_features_list[i] = {k: v for k, v in track_features.items() if k not in [
+                    "track_href", "analysis_url", "type", "uri", "duration_ms", "time_signature", "id"]}
+
+        track_features = pd.DataFrame(track_features_list)
+
+        # Fetch track popularity
+        track_pop_list = []
+        track_pop_response = self.cache.fetch(  # batch size of 50 for track info
+            "tracks", track_uris, lambda uris: self.spotify_call(self.sp.tracks, uris)["tracks"], 50)
+        for track_pop in track_pop_response:
+            if track_pop is not None:
+                track_pop_list.append(
+                    {'track_pop': track_pop['popularity']})
+            else:
+                track_pop_list.append({'track_pop': None})
+
+        track_pop = pd.DataFrame(track_pop_list)
+
+        # Merge dataframes
+        audio_features = pd.concat(
+            [track_features, track_pop], axis=1)
+        track_features = pd.concat(
+            [artist_info, audio_features], axis=1)
+        track_features.insert(0, "track_uri", track_uris.to_numpy())
+
+        return track_features
+
+    def dataset_signature(self, total_rows):
+        """
+        Identifies the current dataset file by its path, size, modification time and row count, so a checkpoint is
+        only resumed against the exact file it was made from
+
+        Args:
+            total_rows (int): The number of rows in the dataset file
+
+        Returns:
+            dict: The signature of the dataset file
+        """
+        dataset_file = self.dataset_file
+        if dataset_file.endswith(".parquet") and not os.path.exists(dataset_file):
+            dataset_file = dataset_file[:-len(".parquet")] + ".csv"
+
+        stat = os.stat(dataset_file)
+        return {"dataset_file": os.path.abspath(dataset_file), "size": stat.st_size, "mtime": stat.st_mtime,
+                "total_rows": total_rows}
+
+    def load_checkpoint(self, checkpoint_file, signature):
+        """
+        Loads the number of dataset rows that already have their audio features saved
+
+        Args:
+            checkpoint_file (str): Path to the checkpoint json file
+            signature (dict): The signature of the current dataset file
+
+        Returns:
+            int: The high-water mark, 0 if there is no checkpoint for the current dataset file
+        """
+        if not os.path.exists(checkpoint_file):
+            return 0
+
+        with open(checkpoint_file, "r") as infile:
+            checkpoint = json.load(infile)
+
+        # A regenerated or different dataset file invalidates the saved part files
+        if checkpoint.get("dataset") != signature:
+            print("Checkpoint is for a different dataset, starting from the beginning")
+            return 0
+
+        return checkpoint["rows_done"]
+
+    def save_checkpoint(self, checkpoint_file, rows_done, signature):
+        """
+        Durably records the number of dataset rows that have their audio features saved
+
+        Args:
+            checkpoint_file (str): Path to the checkpoint json file
+            rows_done (int): The high-water mark
+            signature (dict): The signature of the current dataset file
+        """
+        temp_file = checkpoint_file + ".tmp"
+        with open(temp_file, "w") as outfile:
+            json.dump({"dataset": signature, "rows_done": rows_done}, outfile)
+            outfile.flush()
+            os.fsync(outfile.fileno())
+
+        os.replace(temp_file, checkpoint_file)
+
+    def write_part(self, audio_features, part_file):
+        """
+        Durably writes the audio features of one batch to its own part file
+
+        Args:
+            audio_features (pandas DataFrame): The audio features of the batch
+            part_file (str): Path to the part parquet file
+        """
+        temp_file = part_file + ".tmp"
+        write_dataset(audio_features, temp_file, schema=AUDIO_FEATURES_SCHEMA)
+        with open(temp_file, "rb+") as outfile:
+            os.fsync(outfile.fileno())
+
+        os.replace(temp_file, part_file)
+
+    def combine_parts(self, part_dir, output_file):
+        """
+        Streams every part file, in dataset order, into the output parquet file
+
+        Args:
+            part_dir (str): Directory containing the part files
+            output_file (str): Path to the output parquet file
+        """
+        part_files = sorted(file for file in os.listdir(part_dir) if file.endswith(".parquet"))
+
+        with pq.ParquetWriter(output_file, AUDIO_FEATURES_SCHEMA, compression="zstd") as writer:
+            for part_file in part_files:
+                writer.write_table(pq.read_table(os.path.join(part_dir, part_file)))
+
+    @pipeline_stage("get_audio_features")
+    def get_audio_features(self, output_file, batch_size=100, resume=True):
+        """
+        Extracts music metadata for batches of tracks according to its URIs from every row of the dataset.
+        Each completed batch is written to its own part file and the number of rows done is checkpointed, so an
+        interrupted run carries on from the last saved batch. Only the batches in flight are held in memory.
+        Batches are fetched concurrently by the worker threads, with the shared rate limiter deciding when each request is sent.
+        Once every row is done the part files are combined into the output file.
+
+        Args:
+            output_file (str): The name of the output parquet file
+            batch_size (int): The number of tracks to process in each batch
+            resume (bool): Carry on from the checkpoint of a previous run instead of starting again
+
+        Returns:
+            None
+        """
+        part_dir = os.path.splitext(output_file)[0] + "_parts"
+        checkpoint_file = os.path.join(part_dir, "checkpoint.json")
+        os.makedirs(part_dir, exist_ok=True)
+
+        total_rows = count_rows(self.dataset_file)
+        signature = self.dataset_signature(total_rows)
+        rows_done = self.load_checkpoint(checkpoint_file, signature) if resume else 0
+
+        # Remove part files past the checkpoint left by a run that stopped before checkpointing them
+        for file in os.listdir(part_dir):
+            if file.startswith("part-") and int(file[len("part-"):].split(".")[0]) >= rows_done:
+                os.remove(os.path.join(part_dir, file))
+
+        if rows_done:
+            print(f"Resuming from row {rows_done} of {total_rows}")
+
+        batches = iter_dataset(self.dataset_file, ["track_uri", "artist_uri"], batch_size, start=rows_done)
+        pending = deque()
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while True:
+                # Keep a bounded number of batches in flight so memory stays flat
+                while len(pending) < self.workers * 2:
+                    batch = next(batches, None)
+                    if batch is None:
+                        break
+                    start, uri_df = batch
+                    pending.append((start, len(uri_df), executor.submit(self.process_batch, uri_df)))
+
+                if not pending:
+                    break
+
+                # Batches are saved in dataset order however they complete
+                start, num_rows, future = pending.popleft()
+                self.write_part(future.result(), os.path.join(part_dir, f"part-{start:012d}.parquet"))
+                rows_done = start + num_rows
+                self.metrics.add_rows(num_rows)
+                self.save_checkpoint(checkpoint_file, rows_done, signature)
+                print(f"Completion: {rows_done / total_rows * 100:.2f}%")
+
+        self.combine_parts(part_dir, output_file)
+        shutil.rmtree(part_dir)
+        print(f"{output_file} created")
+        print(f"Response cache: {self.cache.stats()}")
+
+    def partition_by_uri(self, file_path, schema, prefix, work_dir, partitions, chunk_size):
+        """
+        Splits a dataset file into parquet partition files by the hash of each track URI, keeping the original
+        row number of every row in a _row column
+
+        Args:
+            file_path (str): Path to the dataset file
+            schema (pyarrow Schema): The columns and types of the dataset file
+            prefix (str): The name to start each partition file with
+            work_dir (str): Directory to write the partition files to
+            partitions (int): The number of partitions
+            chunk_size (int): The number of rows to read at a time
+
+        Returns:
+            list: The path of each partition file, None for partitions without any rows
+        """
+        partition_schema = schema.append(pa.field("_row", pa.int64()))
+        writers = [None] * partitions
+        partition_files = [None] * partitions
+
+        try:
+            for start, chunk in iter_dataset(file_path, schema.names, chunk_size):
+                chunk["_row"] = np.arange(start, start + len(chunk))
+                if "genres" in chunk.columns:
+                    chunk["genres"] = chunk["genres"].apply(parse_genres)
+
+                partition_ids = pd.util.hash_pandas_object(chunk["track_uri"], index=False) % partitions
+                for partition_id, partition in chunk.groupby(partition_ids.values):
+                    if writers[partition_id] is None:
+                        partition_files[partition_id] = os.path.join(work_dir, f"{prefix}_{partition_id}.parquet")
+                        writers[partition_id] = pq.ParquetWriter(partition_files[partition_id], partition_schema)
+                    writers[partition_id].write_table(
+                        pa.Table.from_pandas(partition, schema=partition_schema, preserve_index=False))
+        finally:
+            for writer in writers:
+                if writer is not None:
+                    writer.close()
+
+        return partition_files
+
+    def merge_by_row(self, joined_files, output_file, schema, total_rows, chunk_size):
+        """
+        Merges joined partition files, each sorted by _row, into the output file in original dataset order,
+        one window of rows at a time
+
+        Args:
+            joined_files (list): Paths of the joined partition files
+            output_file (str): Path to the output parquet file
+            schema (pyarrow Schema): The columns and types of the output file
+            total_rows (int): The number of rows in the dataset
+            chunk_size (int): The number of rows in each window
+        """
+        readers = [pq.ParquetFile(file).iter_batches(batch_size=chunk_size) for file in joined_files]
+        buffers = [None] * len(readers)
+
+        with pq.ParquetWriter(output_file, schema, compression="zstd") as writer:
+            for window_end in range(chunk_size, total_rows + chunk_size, chunk_size):
+                pieces = []
+                for i, reader in enumerate(readers):
+                    # Read ahead until this partition has passed the end of the window
+                    while buffers[i] is None or len(buffers[i]) == 0 or \
+                            buffers[i]["_row"][len(buffers[i]) - 1].as_py() < window_end:
+                        record_batch = next(reader, None)
+                        if record_batch is None:
+                            break
+                        batch = pa.Table.from_batches([record_batch])
+                        buffers[i] = batch if buffers[i] is None else pa.concat_tables([buffers[i], batch])
+
+                    if buffers[i] is None:
+                        continue
+
+                    in_window = int(np.searchsorted(buffers[i]["_row"].to_numpy(), window_end))
+                    pieces.append(buffers[i].slice(0, in_window))
+                    buffers[i] = buffers[i].slice(in_window)
+
+                if pieces:
+                    window = pa.concat_tables(pieces).sort_by("_row").drop(["_row"])
+                    writer.write_table(window.cast(schema))
+
+    @pipeline_stage("join_dataset")
+    def join_dataset(self, partitions=16, chunk_size=500000, how="left"):
+        """
+        Joins the dataset and audio features files on track_uri into the full dataset file without holding either
+        file in memory. Both files are hash partitioned by track_uri, each pair of partitions is joined on its own and
+        the results are merged back into the order of the dataset file.
+
+        Args:
+            partitions (int): The number of partitions, peak memory is roughly the size of both files divided by this
+            chunk_size (int): The number of rows to read and write at a time
+            how (str): "left" keeps tracks without audio features, "inner" drops them
+
+        Returns:
+            dict: The number of tracks without audio features and audio features without a track
+        """
+        if "track_uri" not in dataset_columns(self.audio_features_file):
+            raise ValueError(f"{self.audio_features_file} has no track_uri column, run get_audio_features again")
+
+        dataset_schema = pa.schema([(column, pa.string()) for column in DATASET_COLUMNS])
+        full_schema = pa.schema(list(dataset_schema) + [field for field in AUDIO_FEATURES_SCHEMA
+                                                        if field.name != "track_uri"])
+        joined_schema = full_schema.append(pa.field("_row", pa.int64()))
+        work_dir = tempfile.mkdtemp(dir=os.path.dirname(get_file_path("full_dataset.parquet")))
+        unmatched = {"tracks_without_features": 0, "features_without_track": 0}
+
+        try:
+            dataset_files = self.partition_by_uri(self.dataset_file, dataset_schema, "dataset",
+                                                  work_dir, partitions, chunk_size)
+            features_files = self.partition_by_uri(self.audio_features_file, AUDIO_FEATURES_SCHEMA, "features",
+                                                   work_dir, partitions, chunk_size)
+
+            joined_files = []
+            for partition_id, (dataset_file, features_file) in enumerate(zip(dataset_files, features_files)):
+                features = pq.read_table(features_file).to_pandas() if features_file else \
+                    AUDIO_FEATURES_SCHEMA.empty_table().to_pandas()
+                features = features.drop(columns=["_row"], errors="ignore").drop_duplicates(subset="track_uri")
+
+                if dataset_file is None:
+                    unmatched["features_without_track"] += len(features)
+                    continue
+
+                tracks = pq.read_table(dataset_file).to_pandas()
+
+                unmatched["tracks_without_features"] += int((~tracks["track_uri"].isin(features["track_uri"])).sum())
+                unmatched["features_without_track"] += int((~features["track_uri"].isin(tracks["track_uri"])).sum())
+
+                joined = tracks.merge(features, on="track_uri", how=how).sort_values("_row")
+                joined_file = os.path.join(work_dir, f"joined_{partition_id}.parquet")
+                pq.write_table(pa.Table.from_pandas(joined, schema=joined_schema, preserve_index=False), joined_file)
+                joined_files.append(joined_file)
+
+            self.merge_by_row(joined_files, get_file_path("full_dataset.parquet"), full_schema,
+                              count_rows(self.dataset_file), chunk_size)
+            self.metrics.add_rows(count_rows(get_file_path("full_dataset.parquet")))
+
+            # Tracks added to the previous full dataset don't belong to the new one
+            if os.path.exists(get_file_path(ContentBasedFilter.DELTA_DATASET_FILE)):
+                os.remove(get_file_path(ContentBasedFilter.DELTA_DATASET_FILE))
+
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+        print(f"{unmatched['tracks_without_features']} tracks have no audio features, "
+              f"{unmatched['features_without_track']} audio features have no track in the dataset")
+        return unmatched
+
+
+class TrackNameIndex:
+    """
+    Inverted index over normalised track names, with a token index for word prefix lookups and a trigram index for
+    substring lookups. Postings are stored as sorted keys with offsets into one array of row numbers.
+    """
+    VERSION = 2
+    # Candidate sets larger than this are ranked a partition at a time instead of being sorted whole
+    MAX_SORTED_CANDIDATES = 16384
+
+    def __init__(self, names, tokens, trigrams, sorted_rows=None, lengths=None):
+        """
+        Args:
+            names (list): The normalised name of each row
+            tokens (tuple): The sorted tokens, their posting offsets and the posting rows
+            trigrams (tuple): The sorted trigrams, their posting offsets and the posting rows
+            sorted_rows (numpy array): The rows in name order, computed when not given
+            lengths (numpy array): The length of each name, computed when not given
+        """
+        self.names = names
+        if lengths is None:
+            lengths = np.fromiter((len(name) for name in names), dtype=np.int64, count=len(names))
+        if sorted_rows is None:
+            sorted_rows = np.array(sorted(range(len(names)), key=names.__getitem__), dtype=np.int32)
+        self.lengths = lengths
+        self.sorted_rows = sorted_rows
+        self.tokens = tokens
+        self.trigrams = trigrams
+        self.build_ranks()
+
+    @property
+    def rows(self):
+        return len(self.names)
+
+    def build_ranks(self):
+        """
+        Orders every row by shortest name first, then by its order in the dataset, and records each row's place in
+        that order, also in name order for the whole name prefix lookups
+        """
+        self.ranked_rows = np.argsort(self.lengths, kind="stable").astype(np.int32)
+        self.rank_positions = np.empty(len(self.names), dtype=np.int32)
+        self.rank_positions[self.ranked_rows] = np.arange(len(self.names), dtype=np.int32)
+        self.sorted_positions = self.rank_positions[self.sorted_rows]
+
+    @staticmethod
+    def normalise_name(name):
+        """
+        Lowercases a name, strips accents and replaces punctuation with spaces
+
+        Args:
+            name (str): The name to normalise
+
+        Returns:
+            str: The normalised name
+        """
+        if not isinstance(name, str):
+            return ""
+
+        name = unicodedata.normalize("NFKD", name.lower())
+        name = "".join(char if char.isalnum() else " " for char in name if not unicodedata.combining(char))
+        return " ".join(name.split())
+
+    @staticmethod
+    def build_postings(postings):
+        """
+        Converts a dictionary of posting lists into sorted keys, offsets and one array of rows
+
+        Args:
+            postings (dict): The rows of each key, in ascending order
+
+        Returns:
+            tuple: The sorted keys, the offset of each key's rows and the rows
+        """
+        keys = sorted(postings)
+        offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(postings[key]) for key in keys])
+        rows = np.fromiter((row for key in keys for row in postings[key]), dtype=np.int32, count=offsets[-1])
+        return keys, offsets, rows
+
+    @staticmethod
+    def extend_postings(postings, new_postings):
+        """
+        Appends the rows of new dataset rows to sorted keys, offsets and rows, inserting any keys not seen before.
+        Every new row must come after the rows already in the postings.
+
+        Args:
+            postings (tuple): The sorted keys, offsets and rows
+            new_postings (dict): The rows of each key for the new dataset rows, in ascending order
+
+        Returns:
+            tuple: The sorted keys, the offset of each key's rows and the rows
+        """
+        keys, offsets, rows = postings
+        if not new_postings:
+            return postings
+
+        new_keys = sorted(new_postings)
+        added_keys = [key for key in new_keys if not len(TrackNameIndex.key_rows(postings, key))]
+        merged_keys = list(heapq.merge(keys, added_keys))
+
+        # Each old key moves along by the number of added keys sorted before it
+        shifts = np.zeros(len(keys) + 1, dtype=np.int64)
+        np.add.at(shifts, np.array([bisect.bisect_left(keys, key) for key in added_keys], dtype=np.int64), 1)
+        counts = np.zeros(len(merged_keys), dtype=np.int64)
+        counts[np.arange(len(keys)) + np.cumsum(shifts)[:-1]] = np.diff(offsets)
+        for key in new_keys:
+            counts[bisect.bisect_left(merged_keys, key)] += len(new_postings[key])
+
+        merged_offsets = np.zeros(len(merged_keys) + 1, dtype=np.int64)
+        merged_offsets[1:] = np.cumsum(counts)
+
+        # A key's new rows go after its existing rows, an added key's rows where the next existing key's rows start.
+        # The existing rows are copied across in the slices between them
+        merged_rows = np.empty(merged_offsets[-1], dtype=np.int32)
+        position = previous = 0
+        for key in new_keys:
+            insert_at = offsets[bisect.bisect_right(keys, key)]
+            merged_rows[position:position + insert_at - previous] = rows[previous:insert_at]
+            position += insert_at - previous
+            merged_rows[position:position + len(new_postings[key])] = new_postings[key]
+            position += len(new_postings[key])
+            previous = insert_at
+        merged_rows[position:] = rows[previous:]
+
+        return merged_keys, merged_offsets, merged_rows
+
+    @staticmethod
+    def collect_postings(names, start=0):
+        """
+        Collects the rows of each token and each trigram of normalised names
+
+        Args:
+            names (list): The normalised names
+            start (int): The row of the first name
+
+        Returns:
+            tuple: The rows of each token and the rows of each trigram
+        """
+        token_postings = defaultdict(list)
+        trigram_postings = defaultdict(list)
+
+        for row, name in enumerate(names, start):
+            for token in set(name.split()):
+                token_postings[token].append(row)
+            for trigram in {name[i:i + 3] for i in range(len(name) - 2)}:
+                trigram_postings[trigram].append(row)
+
+        return token_postings, trigram_postings
+
+    @classmethod
+    def build(cls, track_names):
+        """
+        Builds the index from the track names of the full dataset
+
+        Args:
+            track_names (iterable): The track name of each row
+
+        Returns:
+            TrackNameIndex: The built index
+        """
+        names = [cls.normalise_name(name) for name in track_names]
+        token_postings, trigram_postings = cls.collect_postings(names)
+
+        return cls(names, cls.build_postings(token_postings), cls.build_postings(trigram_postings))
+
+    def extend(self, track_names):
+        """
+        Adds the names of rows appended to the full dataset, updating the postings and orders in place instead of
+        rebuilding the index
+
+        Args:
+            track_names (iterable): The track name of each new row, in dataset order
+        """
+        names = [self.normalise_name(name) for name in track_names]
+        start = len(self.names)
+        token_postings, trigram_postings = self.collect_postings(names, start)
+        self.tokens = self.extend_postings(self.tokens, token_postings)
+        self.trigrams = self.extend_postings(self.trigrams, trigram_postings)
+
+        # New rows go after any existing rows with the same name, in name then dataset order among themselves
+        new_rows = sorted(range(start, start + len(names)), key=lambda row: names[row - start])
+        positions = [bisect.bisect_right(self.sorted_rows, names[row - start], key=self.names.__getitem__)
+                     for row in new_rows]
+        self.sorted_rows = np.insert(self.sorted_rows, positions, new_rows).astype(np.int32)
+        self.names = self.names + names
+        self.lengths = np.concatenate([self.lengths, np.fromiter((len(name) for name in names), dtype=np.int64,
+                                                                 count=len(names))])
+        self.build_ranks()
+
+    def save(self, file_path, source):
+        """
+        Saves the index to disk
+
+        Args:
+            file_path (str): Path to the index file
+            source (tuple): Identifies the dataset the index was built from
+        """
+        with open(file_path, "wb") as outfile:
+            pickle.dump({"version": self.VERSION, "source": source, "names": self.names, "tokens": self.tokens,
+                         "trigrams": self.trigrams, "sorted_rows": self.sorted_rows, "lengths": self.lengths},
+                        outfile, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, file_path, source):
+        """
+        Loads the index from disk
+
+        Args:
+            file_path (str): Path to the index file
+            source (tuple): Identifies the dataset the index must have been built from
+
+        Returns:
+            TrackNameIndex: The loaded index, None if there is no index for the dataset
+        """
+        if not os.path.exists(file_path):
+            return None
+
+        with open(file_path, "rb") as infile:
+            data = pickle.load(infile)
+
+        if data.get("version") != cls.VERSION or data.get("source") != source:
+            return None
+
+        return cls(data["names"], data["tokens"], data["trigrams"], data["sorted_rows"], data["lengths"])
+
+    @staticmethod
+    def prefix_rows(postings, prefix):
+        """
+        Gets the rows of every key in a posting list that starts with a prefix
+
+        Args:
+            postings (tuple): The sorted keys, offsets and rows
+            prefix (str): The prefix to look up
+
+        Returns:
+            numpy array: The matching rows
+        """
+        keys, offsets, rows = postings
+        start = bisect.bisect_left(keys, prefix)
+        end = bisect.bisect_left(keys, prefix + "\uffff")
+        return rows[offsets[start]:offsets[end]]
+
+    @staticmethod
+    def key_rows(postings, key):
+        """
+        Gets the rows of a single key in a posting list
+
+        Args:
+            postings (tuple): The sorted keys, offsets and rows
+            key (str): The key to look up
+
+        Returns:
+            numpy array: The rows of the key, empty if the key is not in the index
+        """
+        keys, offsets, rows = postings
+        position = bisect.bisect_left(keys, key)
+        if position == len(keys) or keys[position] != key:
+            return rows[:0]
+        return rows[offsets[position]:offsets[position + 1]]
+
+    @staticmethod
+    def intersect(rows, sorted_rows):
+        """
+        Keeps the rows that are also in an ascending array of rows, in O(len(rows) log len(sorted_rows))
+
+        Args:
+            rows (numpy array): The rows to filter
+            sorted_rows (numpy array): The ascending rows to keep
+
+        Returns:
+            numpy array: The rows found in sorted_rows, in their original order
+        """
+        if not len(sorted_rows):
+            return rows[:0]
+        positions = np.minimum(np.searchsorted(sorted_rows, rows), len(sorted_rows) - 1)
+        return rows[sorted_rows[positions] == rows]
+
+    def rank(self, positions, block_size=256):
+        """
+        Orders rows by shortest name first, then by their order in the dataset. Small candidate sets are sorted
+        whole, large ones are partitioned into blocks of growing size so only the blocks the caller consumes are
+        sorted
+
+        Args:
+            positions (numpy array): The rank positions of the rows to order, may contain duplicates
+            block_size (int): The number of rows in the first block of a large candidate set
+
+        Yields:
+            numpy array: The next block of ordered rows
+        """
+        while len(positions):
+            if len(positions) > max(self.MAX_SORTED_CANDIDATES, block_size):
+                positions = np.partition(positions, block_size - 1)
+                block, positions = positions[:block_size], positions[block_size:]
+                block_size *= 4
+            else:
+                block, positions = positions, positions[:0]
+
+            block = np.sort(block)
+            block = block[np.concatenate(([True], block[1:] != block[:-1]))]
+            yield self.ranked_rows[block]
+
+    def search(self, query, limit=50):
+        """
+        Searches the track names, ranking exact matches first, then names starting with the query, then names with a
+        word starting with the query and finally names containing the query anywhere
+
+        Args:
+            query (str): The text to search for
+            limit (int): The number of rows to return
+
+        Returns:
+            list: The matching rows
+        """
+        query = self.normalise_name(query)
+        if not query:
+            return []
+
+        results = []
+        seen = set()
+
+        def add(positions, contains=None, within=()):
+            # Rows are taken in rank order, keeping those in every ascending array of within and checking they
+            # contain the text when the index alone can't guarantee it
+            for block in self.rank(positions):
+                for other_rows in within:
+                    block = self.intersect(block, other_rows)
+                for row in block.tolist():
+                    if row not in seen and (contains is None or contains in " " + self.names[row]):
+                        seen.add(row)
+                        results.append(row)
+                        if len(results) == limit:
+                            return True
+            return False
+
+        # Exact and whole name prefix matches from the rows in name order
+        start = bisect.bisect_left(self.sorted_rows, query, key=self.names.__getitem__)
+        exact_end = bisect.bisect_right(self.sorted_rows, query, key=self.names.__getitem__)
+        prefix_end = bisect.bisect_left(self.sorted_rows, query + "\uffff", key=self.names.__getitem__)
+        if add(self.sorted_positions[start:exact_end]) or add(self.sorted_positions[start:prefix_end]):
+            return results
+
+        # Word prefix matches from the token index, driven by the rarest word and checking the others per block.
+        # The phrase check covers the last word's prefix when it isn't the rarest
+        words = query.split()
+        candidates = self.prefix_rows(self.tokens, words[-1])
+        if len(words) > 1:
+            word_rows = sorted((self.key_rows(self.tokens, word) for word in words[:-1]), key=len)
+            if len(candidates) > len(word_rows[0]):
+                candidates = word_rows.pop(0)
+            found = add(self.rank_positions[candidates], " " + query, word_rows)
+        else:
+            found = add(self.rank_positions[candidates])
+        if found:
+            return results
+
+        # Substring matches from the trigram index
+        if len(query) >= 3:
+            trigram_rows = sorted((self.key_rows(self.trigrams, query[i:i + 3]) for i in range(len(query) - 2)),
+                                  key=len)
+            add(self.rank_positions[trigram_rows[0]], query, trigram_rows[1:])
+
+        return results
+
+
+class FacetIndex:
+    """
+    Posting lists of the rows of each artist and each genre in the full dataset, used to browse tracks by facet
+    """
+    VERSION = 2
+    FACETS = ("artist", "genre")
+
+    def __init__(self, postings, rows):
+        """
+        Args:
+            postings (dict): The sorted keys, offsets and rows of each facet
+            rows (int): The number of dataset rows indexed
+        """
+        self.postings = postings
+        self.rows = rows
+
+    @staticmethod
+    def collect_postings(dataset, start=0):
+        """
+        Collects the rows of each artist and each genre
+
+        Args:
+            dataset (pandas DataFrame): The artist_name and genres columns of the dataset rows
+            start (int): The row of the first dataset row
+
+        Returns:
+            dict: The rows of each artist and the rows of each genre
+        """
+        artist_postings = defaultdict(list)
+        genre_postings = defaultdict(list)
+
+        for row, (artist_name, genres) in enumerate(zip(dataset["artist_name"], dataset["genres"]), start):
+            artist = TrackNameIndex.normalise_name(artist_name)
+            if artist:
+                artist_postings[artist].append(row)
+            for genre in {TrackNameIndex.normalise_name(genre) for genre in parse_genres(genres)}:
+                genre_postings[genre].append(row)
+
+        return {"artist": artist_postings, "genre": genre_postings}
+
+    @classmethod
+    def build(cls, dataset):
+        """
+        Builds the posting lists from the artist names and genres of the full dataset
+
+        Args:
+            dataset (pandas DataFrame): The artist_name and genres columns of the full dataset
+
+        Returns:
+            FacetIndex: The built index
+        """
+        postings = cls.collect_postings(dataset)
+        return cls({facet: TrackNameIndex.build_postings(postings[facet]) for facet in cls.FACETS}, len(dataset))
+
+    def extend(self, dataset):
+        """
+        Adds the rows appended to the full dataset to the posting lists in place instead of rebuilding the index
+
+        Args:
+            dataset (pandas DataFrame): The artist_name and genres columns of the new rows, in dataset order
+        """
+        postings = self.collect_postings(dataset, self.rows)
+        self.postings = {facet: TrackNameIndex.extend_postings(self.postings[facet], postings[facet])
+                         for facet in self.FACETS}
+        self.rows += len(dataset)
+
+    def save(self, file_path, source):
+        """
+        Saves the index to disk
+
+        Args:
+            file_path (str): Path to the index file
+            source (tuple): Identifies the dataset the index was built from
+        """
+        with open(file_path, "wb") as outfile:
+            pickle.dump({"version": self.VERSION, "source": source, "postings": self.postings, "rows": self.rows},
+                        outfile, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, file_path, source):
+        """
+        Loads the index from disk
+
+        Args:
+            file_path (str): Path to the index file
+            source (tuple): Identifies the dataset the index must have been built from
+
+        Returns:
+            FacetIndex: The loaded index, None if there is no index for the dataset
+        """
+        if not os.path.exists(file_path):
+            return None
+
+        with open(file_path, "rb") as infile:
+            data = pickle.load(infile)
+
+        if data.get("version") != cls.VERSION or data.get("source") != source:
+            return None
+
+        return cls(data["postings"], data["rows"])
+
+    def search(self, facet, value, page=0, page_size=50):
+        """
+        Gets one page of the rows with a facet value. An exact match of the value is used if there is one, otherwise
+        every value starting with it, e.g. "indie" matches "indie pop" and "indie rock".
+
+        Args:
+            facet (str): "artist" or "genre"
+            value (str): The artist name or genre to look up
+            page (int): The page number, starting from 0
+            page_size (int): The number of rows on each page
+
+        Returns:
+            tuple: The rows on the page in dataset order and the total number of matching rows
+        """
+        if facet not in self.FACETS:
+            raise ValueError(f"Unknown facet: {facet}")
+
+        value = TrackNameIndex.normalise_name(value)
+        if not value:
+            return [], 0
+
+        postings = self.postings[facet]
+        rows = TrackNameIndex.key_rows(postings, value)
+        if not len(rows):
+            rows = np.unique(TrackNameIndex.prefix_rows(postings, value))
+
+        return rows[page * page_size:(page + 1) * page_size].tolist(), len(rows)
+
+
+def build_faiss_index(vectors, index_type="Flat", search_params=None, train_size=100000, batch_size=100000):
+    """
+    Builds an inner product FAISS index over L2 normalised vectors
+
+    Args:
+        vectors (numpy array): The normalised vectors, may be a memory map
+        index_type (str): A FAISS index factory string, e.g. "Flat", "IVF4096,Flat", "HNSW32,Flat" or
+            "OPQ32,IVF4096,PQ32"
+        search_params (str): Search time parameters, e.g. "nprobe=64" for IVF or "efSearch=128" for HNSW
+        train_size (int): The number of randomly sampled vectors to train the index on
+        batch_size (int): The number of vectors added to the index at a time
+
+    Returns:
+        faiss.Index: The built index
+    """
+    index = faiss.index_factory(vectors.shape[1], index_type, faiss.METRIC_INNER_PRODUCT)
+
+    if not index.is_trained:
+        sample = np.sort(np.random.default_rng(0).choice(len(vectors), min(train_size, len(vectors)), replace=False))
+        index.train(np.ascontiguousarray(vectors[sample], dtype=np.float32))
+
+    for start in range(0, len(vectors), batch_size):
+        index.add(np.ascontiguousarray(vectors[start:start + batch_size], dtype=np.float32))
+
+    if search_params:
+        faiss.ParameterSpace().set_index_parameters(index, search_params)
+
+    return index
+
+
+class FeaturePipeline:
+    """
+    The fitted transforms that turn tracks into feature vectors. Fitting once and saving the pipeline lets any number
+    of new tracks be featurised later with vectors that stay comparable to the ones in the index.
+    """
+    VERSION = 1
+    OHE_COLUMNS = [("subjectivity", "subject", 0.3), ("polarity", "polar", 0.5), ("key", "key", 0.5), ("mode", "mode", 0.5)]
+    AUDIO_COLUMNS = ["danceability", "energy", "loudness", "speechiness", "acousticness", "instrumentalness", "liveness",
+                     "valence", "tempo"]
+    SENTIMENT_CATEGORIES = {"subject": ["high", "low", "medium"], "polar": ["Negative", "Neutral", "Positive"]}
+    N_COMPONENTS = 100
+
+    def __init__(self, workers=1, sentiment_batch_size=5000):
+        """
+        Args:
+            workers (int): The number of processes track names are analysed in
+            sentiment_batch_size (int): The number of track names sent to a process at a time
+        """
+        self.workers = workers
+        self.sentiment_batch_size = sentiment_batch_size
+        self.tfidf = None
+        self.svd = None
+        self.ohe_columns = None
+        self.pop_scaler = None
+        self.float_cols = None
+        self.float_scaler = None
+
+    def normalise_text(self, text):
+        """
+        Normalise a text for sentiment analysis by collapsing repeated whitespace, which TextBlob ignores. Case is
+        kept because TextBlob scores depend on it, e.g. ":D" is positive but ":d" is neutral
+        """
+        return " ".join(str(text).split())
+
+    def score_texts(self, texts):
+        """
+        Get the (polarity, subjectivity) of each text, fanning out across a process pool for large inputs
+        """
+        if self.workers <= 1 or len(texts) <= self.sentiment_batch_size:
+            return score_sentiments(texts)
+
+        batches = [texts[i:i + self.sentiment_batch_size] for i in range(0, len(texts), self.sentiment_batch_size)]
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            return [score for scores in executor.map(score_sentiments, batches) for score in scores]
+
+    def get_analysis(self, score, task="polarity"):
+        """
+        Get the analysis of a text based on its score
+        """
+        if task == "subjectivity":
+            if score < 1/3:
+                return "low"
+            elif score > 1/3:
+                return "high"
+            else:
+                return "medium"
+        else:
+            if score < 0:
+                return 'Negative'
+            elif score == 0:
+                return 'Neutral'
+            else:
+                return 'Positive'
+
+    def sentiment_analysis(self, df, text_col, memo=None):
+        """
+        Perform sentiment analysis on a text column in a dataframe. Each distinct normalised text is analysed once,
+        repeated titles such as "Intro" reuse its result.
+
+        Args:
+            df (pandas DataFrame): The dataframe to add the subjectivity and polarity columns to
+            text_col (str): The name of the text column
+            memo (dict): The (subjectivity, polarity) of texts analysed by earlier calls, such as earlier chunks of the
+                same dataset. The texts analysed by this call are added to it.
+        """
+
+        memo = {} if memo is None else memo
+        texts = df[text_col].map(self.normalise_text)
+        unique_texts = texts.unique().tolist()
+        new_texts = [text for text in unique_texts if text not in memo]
+        scores = self.score_texts(new_texts)
+
+        memo.update({text: (self.get_analysis(score[1], "subjectivity"), self.get_analysis(score[0]))
+                     for text, score in zip(new_texts, scores)})
+        subjectivity = {text: memo[text][0] for text in unique_texts}
+        polarity = {text: memo[text][1] for text in unique_texts}
+
+        # Store results in new columns using .loc
+        df.loc[:, 'subjectivity'] = texts.map(subjectivity)
+        df.loc[:, 'polarity'] = texts.map(polarity)
+
+        return df
+
+    def ohe_prep(self, df, column, new_name):
+        """
+        One-hot encode a column in a dataframe
+        """
+
+        tf_df = pd.get_dummies(df[column], dtype="uint8")
+        feature_names = tf_df.columns
+        tf_df.columns = [new_name + "|" + str(i) for i in feature_names]
+        tf_df.reset_index(drop=True, inplace=True)
+        return tf_df
+
+    def convert_to_list(self, genres):
+        """
+        Convert the genres of a track to a list and replace spaces in genre name with underscores
+        """
+
+        return [genre.replace(" ", "_") for genre in parse_genres(genres)]
+
+    def genre_documents(self, dataset):
+        """
+        Join the genres of each track into one document for the TF-IDF vectorizer
+        """
+
+        return dataset['genres'].apply(self.convert_to_list).str.join(" ")
+
+    def prepare_columns(self, dataset):
+        """
+        Drop the columns that are not used as features and convert the rest to nullable types
+        """
+
+        dataset = dataset.reset_index(drop=True).convert_dtypes("str").drop(columns=["artist_name", "artist_uri"], errors="ignore")
+        dataset["track_name"] = dataset["track_name"].fillna("")
+        return dataset
+
+    def prepare(self, dataset, sentiment_memo=None):
+        """
+        Prepare the columns of a dataset and add the sentiment of the track names. Datasets that are already prepared
+        are returned unchanged.
+
+        Args:
+            dataset (pandas DataFrame): Tracks with the columns of the full dataset
+            sentiment_memo (dict): The sentiment of track names already analysed, see sentiment_analysis
+
+        Returns:
+            pandas DataFrame: The prepared tracks
+        """
+
+        if "subjectivity" in dataset.columns:
+            return dataset
+
+        return self.sentiment_analysis(self.prepare_columns(dataset), "track_name", sentiment_memo)
+
+    def fit(self, dataset):
+        """
+        Fit the genre, one-hot and scaling transforms
+
+        Args:
+            dataset (pandas DataFrame): Tracks with the columns of the full dataset
+
+        Returns:
+            FeaturePipeline: The fitted pipeline
+        """
+
+        dataset = self.prepare(dataset)
+
+        # Tfidf genre lists
+        self.tfidf = TfidfVectorizer()
+        self.svd = TruncatedSVD(n_components=self.N_COMPONENTS)
+        self.svd.fit(self.tfidf.fit_transform(self.genre_documents(dataset)))
+
+        # One-hot categories
+        self.ohe_columns = {new_name: list(self.ohe_prep(dataset, column, new_name).columns)
+                            for column, new_name, _ in self.OHE_COLUMNS}
+
+        # Popularity and audio scalers
+        self.pop_scaler = MinMaxScaler().fit(dataset[["artist_pop", "track_pop"]])
+        self.float_cols = list(dataset.select_dtypes(include=['Float64']).columns)
+        self.float_scaler = MinMaxScaler().fit(dataset[self.float_cols])
+
+        return self
+
+    def fit_chunks(self, chunks, batch_size=2000):
+        """
+        Fit the transforms one chunk of the dataset at a time, so memory is bounded by the chunk size. The first pass
+        collects the genre document frequencies, one-hot categories and scaler ranges and the second pass fits an
+        incremental PCA of the genre vectors in place of the truncated SVD. Sentiment categories are fixed so track
+        names are not analysed until transform.
+
+        Args:
+            chunks (function): Returns a new iterator over the chunks of the dataset as pandas DataFrames
+            batch_size (int): The number of rows of dense genre vectors the PCA is fitted on at a time
+
+        Returns:
+            FeaturePipeline: The fitted pipeline
+        """
+
+        analyzer = TfidfVectorizer().build_analyzer()
+        document_frequency = Counter()
+        categories = {"key": set(), "mode": set()}
+        rows = 0
+
+        self.pop_scaler = MinMaxScaler()
+        self.float_cols = list(self.AUDIO_COLUMNS)
+        self.float_scaler = MinMaxScaler()
+
+        for chunk in chunks():
+            chunk = self.prepare_columns(chunk)
+            rows += len(chunk)
+            for document in self.genre_documents(chunk):
+                document_frequency.update(set(analyzer(document)))
+            for column, values in categories.items():
+                values.update(chunk[column].dropna().tolist())
+            self.pop_scaler.partial_fit(chunk[["artist_pop", "track_pop"]])
+            self.float_scaler.partial_fit(chunk[self.float_cols])
+
+        # Same vocabulary and smoothed idf weights as fitting TfidfVectorizer on the whole dataset
+        vocabulary = sorted(document_frequency)
+        self.tfidf = TfidfVectorizer(vocabulary=vocabulary)
+        self.tfidf.idf_ = np.log((1 + rows) / (1 + np.array([document_frequency[token] for token in vocabulary]))) + 1
+
+        self.ohe_columns = {new_name: [f"{new_name}|{category}" for category in values]
+                            for new_name, values in self.SENTIMENT_CATEGORIES.items()}
+        self.ohe_columns.update({column: [f"{column}|{category}" for category in sorted(values)]
+                                 for column, values in categories.items()})
+
+        # Every partial fit needs at least N_COMPONENTS rows, so keep that many back for the last one
+        self.svd = IncrementalPCA(n_components=self.N_COMPONENTS)
+        buffer = []
+        buffered = 0
+        for chunk in chunks():
+            tfidf_matrix = self.tfidf.transform(self.genre_documents(self.prepare_columns(chunk)))
+            for start in range(0, tfidf_matrix.shape[0], batch_size):
+                buffer.append(tfidf_matrix[start:start + batch_size].toarray())
+                buffered += len(buffer[-1])
+                if buffered >= batch_size + self.N_COMPONENTS:
+                    batch = np.vstack(buffer)
+                    self.svd.partial_fit(batch[:batch_size])
+                    buffer = [batch[batch_size:]]
+                    buffered = len(buffer[0])
+
+        if buffered:
+            self.svd.partial_fit(np.vstack(buffer))
+        # fit sets the batch size transform uses for sparse input, partial_fit does not
+        self.svd.batch_size_ = batch_size
+
+        return self
+
+    @property
+    def n_features(self):
+        """
+        The length of the feature vectors
+        """
+        return (len(self.float_cols) + self.N_COMPONENTS + 2 +
+                sum(len(columns) for columns in self.ohe_columns.values()))
+
+    def transform(self, dataset, sentiment_memo=None):
+        """
+        Create the feature vectors of tracks with the fitted transforms
+
+        Args:
+            dataset (pandas DataFrame): Tracks with the columns of the full dataset
+            sentiment_memo (dict): The sentiment of track names already analysed, shared across the chunks of a dataset
+                so each distinct name is analysed once in total
+
+        Returns:
+            numpy array: The float32 feature vectors
+        """
+
+        dataset = self.prepare(dataset, sentiment_memo)
+
+        genre_vectors = self.svd.transform(self.tfidf.transform(self.genre_documents(dataset)))
+
+        # One-hot Encoding, with the categories seen when fitting
+        ohe_vectors = [self.ohe_prep(dataset, column, new_name).reindex(
+                           columns=self.ohe_columns[new_name], fill_value=0).values * weight
+                       for column, new_name, weight in self.OHE_COLUMNS]
+
+        # Scale popularity and audio columns
+        pop_scaled = self.pop_scaler.transform(dataset[["artist_pop", "track_pop"]]) * 0.2
+        floats_scaled = self.float_scaler.transform(dataset[self.float_cols]) * 0.2
+
+        feature_vectors = np.hstack([floats_scaled, genre_vectors, pop_scaled] + ohe_vectors).astype(np.float32)
+
+        return np.nan_to_num(feature_vectors, nan=0.0)
+
+    def fit_transform(self, dataset):
+        """
+        Fit the transforms and create the feature vectors of the same tracks, preparing them only once
+
+        Args:
+            dataset (pandas DataFrame): Tracks with the columns of the full dataset
+
+        Returns:
+            numpy array: The float32 feature vectors
+        """
+
+        dataset = self.prepare(dataset)
+        return self.fit(dataset).transform(dataset)
+
+    def save(self, file_path):
+        """
+        Saves the fitted pipeline to disk
+
+        Args:
+            file_path (str): Path to the pipeline file
+        """
+        with open(file_path, "wb") as outfile:
+            pickle.dump({"version": self.VERSION, "state": self.__dict__}, outfile, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, file_path):
+        """
+        Loads a fitted pipeline from disk
+
+        Args:
+            file_path (str): Path to the pipeline file
+
+        Returns:
+            FeaturePipeline: The loaded pipeline, None if there is no pipeline of this version
+        """
+        if not os.path.exists(file_path):
+            return None
+
+        with open(file_path, "rb") as infile:
+            data = pickle.load(infile)
+
+        if data.get("version") != cls.VERSION:
+            return None
+
+        pipeline = cls()
+        pipeline.__dict__.update(data["state"])
+        return pipeline
+
+
+class ContentBasedFilter:
+    SERVING_COLUMNS = ["track_uri", "track_name"]
+    # Tracks added by update_track_database are appended here until the next rebuild merges them into the full dataset
+    DELTA_DATASET_FILE = "full_dataset_delta.parquet"
+    FEATURE_PIPELINE_FILE = "feature_pipeline.pkl"
+    NEIGHBOUR_IDS_FILE = "neighbour_ids.npy"
+    NEIGHBOUR_SCORES_FILE = "neighbour_scores.npy"
+    # Twice the default k of get_neighbours, so excluding rated tracks rarely falls back to a search of the index
+    NEIGHBOUR_GRAPH_SIZE = 100
+    # Multi-centroid profiles use at most this many centroids, each summarising at least MIN_CENTROID_TRACKS likes
+    MAX_CENTROIDS = 4
+    MIN_CENTROID_TRACKS = 5
+    FEATURE_COLUMNS = DATASET_COLUMNS + AUDIO_FEATURES_SCHEMA.names[1:]
+    # Rebuild the index once tracks added since the last build exceed this fraction of it
+    MAX_DELTA_FRACTION = 0.1
+    # Precisions the feature matrix can be stored at, each mapped to the default index type storing its vectors at the
+    # same precision, so a float16 matrix is not searched through a second float32 copy in a flat index
+    MATRIX_DTYPES = {"float32": "Flat", "float16": "SQfp16"}
+
+    def __init__(self, client_id, client_secret, cache=None, metrics=None, mmap=True, index_type=None,
+                 search_params=None, feature_chunk_size=None, workers=1, profile_mode="mean", matrix_dtype="float32"):
+        if str(matrix_dtype) not in self.MATRIX_DTYPES:
+            raise ValueError(f"Unsupported matrix dtype {matrix_dtype}, expected one of {', '.join(self.MATRIX_DTYPES)}")
+
+        self.full_dataset_file = get_file_path("full_dataset.parquet")
+        self.delta_dataset_file = get_file_path(self.DELTA_DATASET_FILE)
+        self.full_dataset = self.read_full_dataset(self.SERVING_COLUMNS)
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.sp = self.create_spotify_client()
+        self.cache = cache or ResponseCache()
+        self.metrics = metrics or PipelineMetrics()
+        self.mmap = mmap
+        self.index_type = index_type or self.MATRIX_DTYPES[str(matrix_dtype)]
+        self.search_params = search_params
+        self.feature_chunk_size = feature_chunk_size
+        self.workers = workers
+        self.profile_mode = profile_mode
+        self.matrix_dtype = np.dtype(matrix_dtype)
+        self.load_vectors()
+        self.uri_array = np.array(self.full_dataset["track_uri"])
+        self.uri_index = self.build_uri_index()
+        self.load_search_indexes()
+        
+    def load_vectors(self):
+        """
+        Loads the normalised feature matrix and the FAISS index. In mmap mode both files are memory-mapped read-only,
+        so startup does not read the whole catalog, pages are only loaded when a search touches them and every process
+        serving the same files shares them through the OS page cache.
+        """
+        matrix_file = get_file_path("feature_matrix_normalised.npy")
+        index_file = get_file_path("index_file.index")
+
+        if self.mmap:
+            self.feature_matrix = np.load(matrix_file, mmap_mode="r")
+            io_flags = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+            self.index = faiss.read_index(index_file, io_flags)
+        else:
+            self.feature_matrix = np.load(matrix_file)
+            self.index = faiss.read_index(index_file)
+
+        # Tracks appended to the feature matrix since the index was built are searched exactly in a small delta index
+        self.delta_index = None
+        if len(self.feature_matrix) > self.index.ntotal:
+            self.delta_index = faiss.IndexFlatIP(self.feature_matrix.shape[1])
+            self.delta_index.add(np.ascontiguousarray(self.feature_matrix[self.index.ntotal:], dtype=np.float32))
+
+        self.load_neighbour_graph()
+
+    def load_neighbour_graph(self):
+        """
+        Memory-maps the precomputed neighbours of each track if build_neighbour_graph has run since the index was last
+        built. Tracks added after the graph was built are not in it and are searched as usual.
+        """
+        ids_file = get_file_path(self.NEIGHBOUR_IDS_FILE)
+        scores_file = get_file_path(self.NEIGHBOUR_SCORES_FILE)
+        index_file = get_file_path("index_file.index")
+
+        self.neighbour_ids = None
+        self.neighbour_scores = None
+        if not (os.path.exists(ids_file) and os.path.exists(scores_file)):
+            return
+
+        # create_index, also run when the added tracks are compacted, makes the graph stale
+        if os.path.getmtime(ids_file) < os.path.getmtime(index_file):
+            print("Neighbour graph is older than the index and is not used, rebuild it from the admin page")
+            return
+
+        self.neighbour_ids = np.load(ids_file, mmap_mode="r")
+        self.neighbour_scores = np.load(scores_file, mmap_mode="r")
+
+    def release_vectors(self):
+        """
+        Drops the feature matrix and index so their files can be rewritten, which Windows refuses while they are mapped
+        """
+        self.feature_matrix = None
+        self.index = None
+        self.delta_index = None
+        self.neighbour_ids = None
+        self.neighbour_scores = None
+
+    def search_index(self, query_vectors, k, exclude=None):
+        """
+        Searches the index and the delta index of recently added tracks, merging their results. Excluded rows never
+        take up one of the k results, the search over-fetches by the number of excluded rows and fetches more only if
+        an approximate index returned too few.
+
+        Args:
+            query_vectors (numpy array): The normalised query vectors
+            k (int): The number of neighbours to return
+            exclude (list): A set of rows to leave out of the results of each query
+
+        Returns:
+            distances (numpy array): Similarities of the nearest tracks of each query, -inf where there are fewer than k
+            indices (numpy array): Rows of the nearest tracks of each query, -1 where there are fewer than k
+        """
+        if not exclude or not any(exclude):
+            return self.search_vectors(query_vectors, k)
+
+        total = len(self.feature_matrix)
+        fetch = min(k + max(len(rows) for rows in exclude), total)
+
+        while True:
+            distances, indices = self.search_vectors(query_vectors, fetch)
+            keep = (indices >= 0) & ~np.array([np.isin(query_indices, list(rows))
+                                               for query_indices, rows in zip(indices, exclude)])
+            if fetch >= total or (keep.sum(axis=1) >= k).all():
+                break
+            fetch = min(fetch * 2, total)
+
+        # Move the kept results to the front of each row, keeping their order
+        order = np.argsort(~keep, axis=1, kind="stable")[:, :k]
+        keep = np.take_along_axis(keep, order, axis=1)
+        distances = np.where(keep, np.take_along_axis(distances, order, axis=1), -np.inf)
+        indices = np.where(keep, np.take_along_axis(indices, order, axis=1), -1)
+
+        return distances, indices
+
+    def search_vectors(self, query_vectors, k):
+        """
+        Searches the index and the delta index of recently added tracks, merging their results
+
+        Args:
+            query_vectors (numpy array): The normalised query vectors
+            k (int): The number of neighbours to return
+
+        Returns:
+            distances (numpy array): Similarities of the nearest tracks of each query
+            indices (numpy array): Rows of the nearest tracks of each query
+        """
+        distances, indices = self.index.search(query_vectors, k)
+        if self.delta_index is None:
+            return distances, indices
+
+        delta_distances, delta_indices = self.delta_index.search(query_vectors, k)
+        delta_indices = np.where(delta_indices >= 0, delta_indices + self.index.ntotal, -1)
+
+        distances = np.hstack([distances, delta_distances])
+        indices = np.hstack([indices, delta_indices])
+        distances[indices < 0] = -np.inf
+        order = np.argsort(-distances, axis=1, kind="stable")[:, :k]
+
+        return np.take_along_axis(distances, order, axis=1), np.take_along_axis(indices, order, axis=1)
+
+    def read_full_dataset(self, columns=None):
+        """
+        Reads the full dataset followed by the tracks added to it since it was last written
+
+        Args:
+            columns (list): The columns to load, None loads every column
+
+        Returns:
+            pandas DataFrame: The full dataset
+        """
+        full_dataset = read_dataset(self.full_dataset_file, columns=columns)
+        if not os.path.exists(self.delta_dataset_file):
+            return full_dataset
+
+        return pd.concat([full_dataset, read_dataset(self.delta_dataset_file, columns=columns)], ignore_index=True)
+
+    def read_added_rows(self, start, columns=None):
+        """
+        Reads the rows of the full dataset from a given row onwards, only reading the delta file when they are all in it
+
+        Args:
+            start (int): The first row to read
+            columns (list): The columns to load, None loads every column
+
+        Returns:
+            pandas DataFrame: The rows from start onwards
+        """
+        full_dataset_rows = count_rows(self.full_dataset_file)
+        if start >= full_dataset_rows and os.path.exists(self.delta_dataset_file):
+            return read_dataset(self.delta_dataset_file, columns=columns).iloc[start - full_dataset_rows:]
+
+        return self.read_full_dataset(columns).iloc[start:]
 
-        artist_info = pd.DataFrame(
-            [{'artist_pop': artist['popularity'], 'genres': artist['genres']} for artist in artist_info_list])
+    def append_to_dataset(self, new_tracks):
+        """
+        Persists tracks added to the full dataset by writing only the delta file, the full dataset file is untouched
 
-        # Fetch track audio features
-        track_features_list = []
-        for i in range(0, len(track_uris), 100):  # batch size of 100 for audio features
-            track_features_list.extend(self.spotify_call(
-                self.sp.audio_features, track_uris[i:i+100]))
-            for i, track_features in enumerate(track_features_list):
-                if track_features is None:
-                    track_features_list[i] = {'danceability': None, 'energy': None, 'key': None, 'loudness': None, 'mode': None,
-                                              'speechiness': None, 'acousticness': None, 'instrumentalness': None, 'liveness': None, 'valence': None, 'tempo': None}
-                else:
-                    track_features_list[i] = {k: v for k, v in track_features.items() if k not in [
-                        "track_href", "analysis_url", "type", "uri", "duration_ms", "time_signature", "id"]}
+        Args:
+            new_tracks (pandas DataFrame): The tracks to add, in the order they are appended
+        """
+        if os.path.exists(self.delta_dataset_file):
+            new_tracks = pd.concat([read_dataset(self.delta_dataset_file), new_tracks], ignore_index=True)
 
-        track_features = pd.DataFrame(track_features_list)
+        # Match the column types of the full dataset so both files read back as one table
+        schema = pq.read_schema(self.full_dataset_file) if os.path.exists(self.full_dataset_file) else None
+        write_dataset(new_tracks, self.delta_dataset_file + ".tmp", schema=schema)
+        os.replace(self.delta_dataset_file + ".tmp", self.delta_dataset_file)
 
-        # Fetch track popularity
-        track_pop_list = []
-        for i in range(0, len(track_uris), 50):  # batch size of 50 for track info
-            track_pop_response = self.spotify_call(
-                self.sp.tracks, track_uris[i:i+50])
-            for track_pop in track_pop_response["tracks"]:
-                if track_pop is not None:
-                    track_pop_list.append(
-                        {'track_pop': track_pop['popularity']})
-                else:
-                    track_pop_list.append({'track_pop': None})
+    def compact_dataset(self):
+        """
+        Merges the delta file into the full dataset file. The search indexes already cover every row, so they are saved
+        again against the rewritten file instead of being rebuilt.
+        """
+        if not os.path.exists(self.delta_dataset_file):
+            return
 
-        track_pop = pd.DataFrame(track_pop_list)
+        write_dataset(self.read_full_dataset(), self.full_dataset_file + ".tmp")
+        os.replace(self.full_dataset_file + ".tmp", self.full_dataset_file)
+        os.remove(self.delta_dataset_file)
+        print("Merged the added tracks into the full dataset")
 
-        # Merge dataframes
-        audio_features = pd.concat(
-            [track_features, track_pop], axis=1)
-        track_features = pd.concat(
-            [artist_info, audio_features], axis=1)
+        source = self.dataset_source()
+        self.name_index.save(get_file_path("track_name_index.pkl"), source)
+        self.facet_index.save(get_file_path("facet_index.pkl"), source)
 
-        return track_features
+    def dataset_source(self):
+        """
+        Identifies the full dataset file the search indexes are built from. Rows in the delta file are not part of it,
+        an index covering fewer rows than the full dataset is extended with them.
 
-    def get_audio_features(self, output_file, batch_size=100):
+        Returns:
+            tuple: The number of rows and the modification time of the full dataset file
+        """
+        return (count_rows(self.full_dataset_file), os.path.getmtime(self.full_dataset_file)
+                if os.path.exists(self.full_dataset_file) else None)
+
+    def load_search_index(self, index_class, file_name, build, extend):
         """
-        Extracts music metadata for batches of tracks according to its URIs from the dataset, saves the resulting df from each batch in a list and concatinates the list at the end and saves the df as the output file to disk.
+        Loads a search index saved alongside the full dataset, building and saving it if it is missing or was built
+        from a different version of the dataset. An index missing the rows added since it was saved is extended with
+        just those rows.
 
         Args:
-            input_file (str): The name of the input CSV file
-            output_file (str): The name of the output CSV file
-            batch_size (int): The number of tracks to process in each batch
+            index_class (class): TrackNameIndex or FacetIndex
+            file_name (str): The name of the index file
+            build (function): Builds the index from the full dataset
+            extend (function): Adds the rows from a given row onwards to the index
 
         Returns:
-            None
+            The search index
         """
-        # Load data
-        uri_df = pd.read_csv(self.csv_file, engine="pyarrow").drop(
-            columns=["track_name", "artist_name"])
-
-        # Prepare dataframe for results
-        df_list = []
-
-        for i in range(0, 1000, batch_size):
-            time.sleep(random.uniform(0, 1))
-            batch = uri_df.iloc[i:i + batch_size]
-            audio_features = self.process_batch(batch)
-            df_list.append(audio_features)
-            print(len(df_list))
-            print(f"Completion: {(i + 1) / len(uri_df) * 100:.2f}%")
-
-        # Save final dataframe
-        if not os.path.exists(output_file):
-            columns = ["artist_pop", "genres", "danceability", "energy", "key", "loudness", "mode",
-                       "speechiness", "acousticness", "instrumentalness", "liveness", "valence", "tempo", "track_pop"]
-            df = pd.DataFrame(columns=columns)
-            df.to_csv(output_file, index=False)
-            print(f"{output_file} created with columns: {
-                  ', '.join(columns)}")
-        else:
-            print(f"{output_file} already exists.")
+        index_file = get_file_path(file_name)
+        source = self.dataset_source()
 
-        audio_features = pd.concat(df_list, ignore_index=True)
-        audio_features.to_csv(
-            output_file, mode="a", index=False, header=False)
+        search_index = index_class.load(index_file, source)
+        if search_index is None or search_index.rows > len(self.full_dataset):
+            search_index = build()
+            search_index.save(index_file, source)
+            print(f"{file_name} saved to disk")
 
-    def join_uri(self):
-        track_uri = pd.read_csv(self.csv_file, engine="pyarrow")[
-            "track_uri"]
-        audio_features = pd.read_csv(
-            self.audio_features_file, engine="pyarrow")
+        elif search_index.rows < len(self.full_dataset):
+            added = len(self.full_dataset) - search_index.rows
+            extend(search_index, search_index.rows)
+            search_index.save(index_file, source)
+            print(f"Added {added} tracks to {file_name}")
 
-        audio_features = pd.concat([track_uri, audio_features], axis=1)
-        audio_features.to_csv(get_file_path("audio_features.csv"), index=False)
+        return search_index
 
-    def join_dataset(self):
-        dataset = pd.read_csv(self.csv_file, engine="pyarrow")
-        audio_features = pd.read_csv(
-            self.audio_features_file, engine="pyarrow")
-        full_dataset = pd.concat([dataset, audio_features], axis=1)
-        full_dataset.to_csv(get_file_path("full_dataset.csv"), index=False)
+    def load_search_indexes(self):
+        """
+        Loads the track name and facet search indexes
+        """
+        self.name_index = self.load_search_index(
+            TrackNameIndex, "track_name_index.pkl", lambda: TrackNameIndex.build(self.full_dataset["track_name"]),
+            lambda index, start: index.extend(self.full_dataset["track_name"].iloc[start:]))
+        self.facet_index = self.load_search_index(
+            FacetIndex, "facet_index.pkl", lambda: FacetIndex.build(self.read_full_dataset(["artist_name", "genres"])),
+            lambda index, start: index.extend(self.read_added_rows(start, ["artist_name", "genres"])))
+
+    def build_uri_index(self):
+        """
+        Builds a hash index from each track URI to its row in the full dataset, keeping the first row of any duplicates
 
+        Returns:
+            dict: The row of each track URI
+        """
+        return dict(zip(self.uri_array[::-1], range(len(self.uri_array) - 1, -1, -1)))
 
-class ContentBasedFilter:
-    def __init__(self, client_id, client_secret):
-        self.full_dataset = pd.read_csv(
-            get_file_path("full_dataset.csv"), engine="pyarrow",)
-        self.client_id = client_id
-        self.client_secret = client_secret
-        self.sp = self.create_spotify_client()
-        self.feature_matrix = np.load(get_file_path("feature_matrix_normalised.npy"))
-        self.index = faiss.read_index(get_file_path("index_file.index"))
-        self.uri_array = np.array(self.full_dataset["track_uri"])
-        
     def create_spotify_client(self):
         """
         Creates a Spotify client using the SpotifyClientCredentials manager.
@@ -331,112 +2650,87 @@ class ContentBasedFilter:
                     print(f"SpotifyException: {e}")
                     raise
     
-    def get_subjectivity(self, text):
-        """
-        Get the subjectivity of a text
-        """
-        return TextBlob(text).sentiment.subjectivity
+    @pipeline_stage("process_data")
+    def process_data(self, chunk_size=None):
+        '''
+        Process the full dataset to create a final set of features that is machine readable that will be used to generate recommendations
 
-    def get_polarity(self, text):
-        """
-        Get the polarity of a text
-        """
-        return TextBlob(text).sentiment.polarity
+        Args:
+            chunk_size (int): Build the features out of core in chunks of this many rows, defaults to the
+                feature_chunk_size of the filter. None processes the whole dataset in memory.
+        '''
 
-    def get_analysis(self, score, task="polarity"):
-        """
-        Get the analysis of a text based on its score
-        """
-        if task == "subjectivity":
-            if score < 1/3:
-                return "low"
-            elif score > 1/3:
-                return "high"
-            else:
-                return "medium"
-        else:
-            if score < 0:
-                return 'Negative'
-            elif score == 0:
-                return 'Neutral'
-            else:
-                return 'Positive'
+        # Features are built from the full dataset file alone, so merge in any tracks added since it was written
+        self.compact_dataset()
 
-    def sentiment_analysis(self, df, text_col):
-        """
-        Perform sentiment analysis on a text column in a dataframe
-        """
+        chunk_size = chunk_size or self.feature_chunk_size
+        if chunk_size:
+            return self.process_data_chunked(chunk_size)
 
-        # Apply functions and store results in new columns using .loc
-        df.loc[:, 'subjectivity'] = df[text_col].apply(
-            self.get_subjectivity).apply(lambda x: self.get_analysis(x, "subjectivity"))
-        df.loc[:, 'polarity'] = df[text_col].apply(
-            self.get_polarity).apply(self.get_analysis)
+        feature_pipeline = FeaturePipeline(workers=self.workers)
+        feature_vectors = feature_pipeline.fit_transform(read_dataset(self.full_dataset_file))
+        feature_df = pd.DataFrame(feature_vectors, columns=[f'feature_{i+1}' for i in range(feature_vectors.shape[1])], dtype=np.float32)
 
-        return df
+        self.metrics.add_rows(len(feature_df))
 
-    def ohe_prep(self, df, column, new_name):
-        """
-        One-hot encode a column in a dataframe
-        """
+        feature_df.to_hdf(get_file_path("complete_feature_df.h5"), key="df", mode="w")
+        print("Complete feature df saved to disk")
 
-        tf_df = pd.get_dummies(df[column], dtype="uint8")
-        feature_names = tf_df.columns
-        tf_df.columns = [new_name + "|" + str(i) for i in feature_names]
-        tf_df.reset_index(drop=True, inplace=True)
-        return tf_df
+        # Keep the fitted transforms so new tracks can be added without refitting
+        feature_pipeline.save(get_file_path(self.FEATURE_PIPELINE_FILE))
 
-    def convert_to_list(self, genre_str):
-        '''
-        Convert a string of genres to a list and replace spaces in genre name with underscores
+    def process_data_chunked(self, chunk_size):
         '''
+        Build the normalised feature matrix one chunk of the full dataset at a time, writing each chunk straight into a
+        preallocated .npy file, so peak memory is bounded by the chunk size rather than the catalog. The file is
+        written alongside the current matrix and replaces it once complete, so processes that have the current matrix
+        memory-mapped keep reading it unchanged.
 
-        try:
-            return [genre.replace(" ", "_") for genre in ast.literal_eval(genre_str)]
-        except (ValueError, SyntaxError):
-            return []
-
-    def process_data(self):
-        '''
-        Process the full dataset to create a final set of features that is machine readable that will be used to generate recommendations
+        Args:
+            chunk_size (int): The number of rows processed at a time
         '''
 
-        full_dataset = self.full_dataset.convert_dtypes("str").drop(columns=["artist_name", "artist_uri"])
-        full_dataset["track_name"] = full_dataset["track_name"].fillna("")
-        float_cols = full_dataset.select_dtypes(include=['Float64']).columns
+        def chunks():
+            for _, chunk in iter_dataset(self.full_dataset_file, self.FEATURE_COLUMNS, chunk_size):
+                yield chunk
+
+        feature_pipeline = FeaturePipeline(workers=self.workers).fit_chunks(chunks)
+        print("Feature pipeline fitted")
+
+        matrix_file = get_file_path("feature_matrix_normalised.npy")
+        feature_matrix = np.lib.format.open_memmap(matrix_file + ".tmp.npy", mode="w+", dtype=self.matrix_dtype,
+                                                   shape=(count_rows(self.full_dataset_file), feature_pipeline.n_features))
+        # Names repeated across chunks, such as "Intro", are analysed once for the whole dataset
+        sentiment_memo = {}
+        for start, chunk in iter_dataset(self.full_dataset_file, self.FEATURE_COLUMNS, chunk_size):
+            feature_vectors = feature_pipeline.transform(chunk, sentiment_memo)
+            faiss.normalize_L2(feature_vectors)
+            feature_matrix[start:start + len(feature_vectors)] = feature_vectors
+            self.metrics.add_rows(len(feature_vectors))
+
+        feature_matrix.flush()
+        del feature_matrix
+        os.replace(matrix_file + ".tmp.npy", matrix_file)
+        print("Feature matrix saved to disk")
+
+        feature_pipeline.save(get_file_path(self.FEATURE_PIPELINE_FILE))
 
-        # Tfidf genre lists
-        tfidf = TfidfVectorizer()
-        tfidf_matrix = tfidf.fit_transform(full_dataset['genres'].apply(self.convert_to_list).str.join(" "))
-        svd = TruncatedSVD(n_components=100)
-        genre_df = pd.DataFrame(svd.fit_transform(tfidf_matrix), dtype=np.float32)
-        genre_df.columns = [f'genre_{i+1}' for i in range(genre_df.shape[1])]
-
-        # Sentiment analysis
-        df = self.sentiment_analysis(full_dataset, "track_name")
-
-        # One-hot Encoding
-        subject_ohe = self.ohe_prep(df, 'subjectivity', 'subject') * 0.3
-        polar_ohe = self.ohe_prep(df, 'polarity', 'polar') * 0.5
-        key_ohe = self.ohe_prep(df, 'key', 'key') * 0.5
-        mode_ohe = self.ohe_prep(df, 'mode', 'mode') * 0.5
-
-        # Scale popularity columns
-        pop = full_dataset[["artist_pop", "track_pop"]]
-        pop_scaled = pd.DataFrame(MinMaxScaler().fit_transform(pop), columns=pop.columns, dtype=np.float32) * 0.2
-
-        # Scale audio columns
-        floats = full_dataset[float_cols]
-        floats_scaled = pd.DataFrame(MinMaxScaler().fit_transform(floats), columns=floats.columns, dtype=np.float32) * 0.2
-
-        feature_vectors = np.hstack([floats_scaled.values, genre_df.values, pop_scaled.values,
-                                     subject_ohe.values, polar_ohe.values, key_ohe.values, mode_ohe.values])
-        feature_df = pd.DataFrame(feature_vectors, columns=[f'feature_{i+1}' for i in range(feature_vectors.shape[1])], dtype=np.float32)
+    @pipeline_stage("add_tracks")
+    def add_tracks(self, new_tracks, feature_pipeline):
+        '''
+        Featurise new tracks with the fitted transforms and append their normalised vectors to the feature matrix,
+        without refitting or rebuilding the index
 
-        feature_df.fillna(0, inplace=True)
+        Args:
+            new_tracks (pandas dataframe): Tracks that are not in the full dataset, in the order they were appended
+            feature_pipeline (FeaturePipeline): The pipeline fitted by process_data
+        '''
 
-        feature_df.to_hdf(get_file_path("complete_feature_df.h5"), key="df", mode="w")
-        print("Complete feature df saved to disk")
+        feature_vectors = feature_pipeline.transform(new_tracks)
+        faiss.normalize_L2(feature_vectors)
+        append_npy_rows(get_file_path("feature_matrix_normalised.npy"), feature_vectors)
+        self.metrics.add_rows(len(feature_vectors))
+        print(f"Appended {len(feature_vectors)} tracks to the feature matrix")
 
     def create_feature_matrix(self):
         """
@@ -475,7 +2769,7 @@ class ContentBasedFilter:
         if os.path.exists(get_file_path("feature_matrix_normalised.npy")):
             os.remove(get_file_path("feature_matrix_normalised.npy"))
 
-        np.save(get_file_path("feature_matrix_normalised.npy"), feature_matrix)
+        np.save(get_file_path("feature_matrix_normalised.npy"), feature_matrix.astype(self.matrix_dtype))
         print("Feature matrix saved to disk")
 
     def normalise_track_vector(self, feature_matrix, track_uri):
@@ -491,41 +2785,50 @@ class ContentBasedFilter:
             None
         """
 
-        track_index = self.full_dataset.index[self.full_dataset["track_uri"] == track_uri].tolist(
-        )
+        track_index = self.uri_index.get(track_uri)
 
-        if not track_index:
+        if track_index is None:
             raise ValueError("Track URI not found in the DataFrame")
 
-        track_index = track_index[0]
-
-        track_vector = feature_matrix[track_index].reshape(1, -1)
-
-        track_vector = np.ascontiguousarray(track_vector)
+        # Copy the row, the feature matrix may be a read-only memory map
+        track_vector = np.array(feature_matrix[track_index], dtype=np.float32).reshape(1, -1)
         faiss.normalize_L2(track_vector)
 
         return track_vector
 
-    def create_index(self):
+    @pipeline_stage("create_index")
+    def create_index(self, index_type=None, search_params=None, train_size=100000):
         """
-        Get the similarities between the track vector and the feature matrix using FAISS
+        Build the FAISS index over the normalised feature matrix and save it to disk. The default "Flat" index is an
+        exact search, approximate index types trade recall for speed and memory on large catalogs, see benchmarks.py.
+        Quantized index types such as "SQfp16", "SQ8" or "PQ32" store the vectors in 2 bytes, 1 byte or a fraction of
+        a byte per dimension instead of a second float32 copy of the matrix. A float16 matrix defaults to "SQfp16".
 
-        Returns:
-            indices (numpy array): Indices of the most similar tracks
-            distances (numpy array): Distances of the most similar tracks
+        Args:
+            index_type (str): A FAISS index factory string, defaults to the index type of the filter
+            search_params (str): Search time parameters saved with the index, e.g. "nprobe=64"
+            train_size (int): The number of vectors to train approximate indexes on
         """
 
         try:
-            # Create a new index
-            if os.path.exists(get_file_path("feature_matrix_normalised.npy")):
-                pass
-
-            else:
+            # Normalise the feature matrix again if process_data has run since it was saved
+            matrix_file = get_file_path("feature_matrix_normalised.npy")
+            feature_df_file = get_file_path("complete_feature_df.h5")
+            if not os.path.exists(matrix_file) or (os.path.exists(feature_df_file) and
+                                                   os.path.getmtime(feature_df_file) > os.path.getmtime(matrix_file)):
                 self.normalise_feature_matrix()
-            feature_matrix = np.load(get_file_path("feature_matrix_normalised.npy"))
-            index = faiss.IndexFlatIP(feature_matrix.shape[1])
+            feature_matrix = np.load(matrix_file, mmap_mode="r")
+
+            # Store the matrix at the configured precision, e.g. float16 halves its size
+            if feature_matrix.dtype != self.matrix_dtype:
+                np.save(matrix_file + ".tmp.npy", feature_matrix.astype(self.matrix_dtype))
+                del feature_matrix
+                os.replace(matrix_file + ".tmp.npy", matrix_file)
+                feature_matrix = np.load(matrix_file, mmap_mode="r")
 
-            index.add(feature_matrix)
+            index = build_faiss_index(feature_matrix, index_type or self.index_type,
+                                      search_params or self.search_params, train_size)
+            self.metrics.add_rows(index.ntotal)
 
             if os.path.exists(get_file_path("index_file.index")):
                 os.remove(get_file_path("index_file.index"))
@@ -536,15 +2839,93 @@ class ContentBasedFilter:
             print(f"An error occurred: {e}")
             raise
     
+    @pipeline_stage("build_neighbour_graph")
+    def build_neighbour_graph(self, k=NEIGHBOUR_GRAPH_SIZE, batch_size=10000):
+        """
+        Offline job that searches the k nearest neighbours of every track in batches and saves them as an (N, k) int32
+        array of rows and an (N, k) float16 array of similarities, so single track recommendations become a lookup.
+        More neighbours are kept than get_neighbours returns, leaving room for the tracks it excludes.
+
+        Tracks added through the delta index after the graph is built never appear in the neighbour lists of existing
+        tracks until the graph is rebuilt, although they are still returned when get_neighbours falls back to a search.
+
+        Args:
+            k (int): The number of neighbours to keep for each track, not counting the track itself
+            batch_size (int): The number of tracks searched at a time
+        """
+        ids_file = get_file_path(self.NEIGHBOUR_IDS_FILE)
+        scores_file = get_file_path(self.NEIGHBOUR_SCORES_FILE)
+        rows = len(self.feature_matrix)
+
+        # Write to temporary files and swap them in, the current graph may still be mapped
+        neighbour_ids = np.lib.format.open_memmap(ids_file + ".tmp", mode="w+", dtype=np.int32, shape=(rows, k))
+        neighbour_scores = np.lib.format.open_memmap(scores_file + ".tmp", mode="w+", dtype=np.float16, shape=(rows, k))
+
+        for start in range(0, rows, batch_size):
+            query_vectors = np.ascontiguousarray(self.feature_matrix[start:start + batch_size], dtype=np.float32)
+            distances, indices = self.search_vectors(query_vectors, min(k + 1, rows))
+
+            # Drop each track from its own neighbours, or the furthest neighbour if the track was not returned
+            is_self = indices == np.arange(start, start + len(indices))[:, None]
+            order = np.argsort(is_self, axis=1, kind="stable")[:, :k]
+            indices = np.take_along_axis(indices, order, axis=1)
+            distances = np.take_along_axis(distances, order, axis=1)
+
+            neighbour_ids[start:start + len(indices), :indices.shape[1]] = indices
+            neighbour_ids[start:start + len(indices), indices.shape[1]:] = -1
+            neighbour_scores[start:start + len(indices), :indices.shape[1]] = distances
+            neighbour_scores[start:start + len(indices), indices.shape[1]:] = -np.inf
+            self.metrics.add_rows(len(indices))
+
+        neighbour_ids.flush()
+        neighbour_scores.flush()
+        del neighbour_ids, neighbour_scores
+
+        self.neighbour_ids = None
+        self.neighbour_scores = None
+        os.replace(ids_file + ".tmp", ids_file)
+        os.replace(scores_file + ".tmp", scores_file)
+        self.load_neighbour_graph()
+        print("Neighbour graph saved to disk")
+
+    def get_neighbours(self, track_uri, k=50, exclude_uris=None):
+        """
+        Get the tracks most similar to a single track, the "more like this" of a track. The precomputed neighbour graph
+        is used when it has the track and enough neighbours left after the exclusions, otherwise the index is searched.
+        Tracks added since the graph was built are only returned by the search, see build_neighbour_graph.
+
+        Args:
+            track_uri (str): Track URI
+            k (int): The number of similar tracks to return
+            exclude_uris (list): Track URIs that must not be returned
+
+        Returns:
+            indices (numpy array): Indices of the most similar tracks, never the track itself
+            distances (numpy array): Distances of the most similar tracks
+        """
+        track_index = self.uri_index.get(track_uri)
+        if track_index is None:
+            raise ValueError("Track URI not found in the DataFrame")
+
+        exclude = {self.uri_index[uri] for uri in exclude_uris or [] if uri in self.uri_index}
+
+        if self.neighbour_ids is not None and track_index < len(self.neighbour_ids):
+            indices = np.asarray(self.neighbour_ids[track_index], dtype=np.int64)
+            distances = np.asarray(self.neighbour_scores[track_index], dtype=np.float32)
+            keep = (indices >= 0) & ~np.isin(indices, list(exclude))
+            if keep.sum() >= k:
+                return indices[keep][:k], distances[keep][:k]
+
+        track_vector = self.normalise_track_vector(self.feature_matrix, track_uri)
+        distances, indices = self.search_index(track_vector, k, [exclude | {track_index}])
+        found = indices[0] >= 0
+        return indices[0][found], distances[0][found]
+
     def get_index(self, uri):
-        try:
-            return self.full_dataset.index[self.full_dataset["track_uri"] == uri].tolist()[0]
-        
-        except IndexError:
-            return None
+        return self.uri_index.get(uri)
     
     def get_weighted_vector(self, vectors, weights=None):
-        if not vectors:
+        if len(vectors) == 0:
             return np.zeros(self.feature_matrix.shape[1])
 
         # Convert vectors to a numpy array
@@ -565,50 +2946,285 @@ class ContentBasedFilter:
 
         return weighted_vector
 
-    def get_similarities(self, track_uris_with_opinions):
+    def get_profile_vectors(self, users_track_uris_with_opinions):
         """
-        Get the similarities between the track vector and the feature matrix using FAISS
+        Build the normalised query vector of many users in one vectorised pass. A user with a single opinion is
+        represented by that track, otherwise by the mean of their liked tracks minus the mean of their disliked tracks.
 
         Args:
-            track_uri
+            users_track_uris_with_opinions (list): The (track_uri, opinion, ...) tuples of each user
+
+        Returns:
+            profile_vectors (numpy array): The normalised query vector of each user, zero for users with no known tracks
+        """
+
+        users, rows, weights = [], [], []
+        for user, track_uris_with_opinions in enumerate(users_track_uris_with_opinions):
+            known = [(self.uri_index[opinion[0]], opinion[1]) for opinion in track_uris_with_opinions
+                     if opinion[0] in self.uri_index]
+
+            if len(known) == 1:
+                users.append(user)
+                rows.append(known[0][0])
+                weights.append(1.0)
+                continue
+
+            liked = [row for row, opinion in known if opinion == 1]
+            disliked = [row for row, opinion in known if opinion == 0]
+            users.extend([user] * (len(liked) + len(disliked)))
+            rows.extend(liked + disliked)
+            weights.extend([1.0 / max(len(liked), 1)] * len(liked) + [-1.0 / max(len(disliked), 1)] * len(disliked))
+
+        profile_vectors = np.zeros((len(users_track_uris_with_opinions), self.feature_matrix.shape[1]), dtype=np.float32)
+        if rows:
+            np.add.at(profile_vectors, np.array(users),
+                      self.feature_matrix[np.array(rows)] * np.array(weights, dtype=np.float32)[:, None])
+
+        faiss.normalize_L2(profile_vectors)
+        return profile_vectors
+
+    @property
+    def feature_version(self):
+        """
+        Identifies the fitted feature pipeline the vectors in the feature matrix were made with and the precision they
+        are stored at, user profiles summed from other vectors must be rebuilt
+        """
+        pipeline_file = get_file_path(self.FEATURE_PIPELINE_FILE)
+        pipeline_mtime = os.path.getmtime(pipeline_file) if os.path.exists(pipeline_file) else 0.0
+        dtype = self.feature_matrix.dtype if self.feature_matrix is not None else self.matrix_dtype
+        return f"{pipeline_mtime}:{dtype.name}"
+
+    def get_track_vector(self, track_uri):
+        """
+        Get the normalised feature vector of a track
+
+        Args:
+            track_uri (str): Track URI
+
+        Returns:
+            numpy array: The float64 feature vector, None if the track is not in the dataset
+        """
+        track_index = self.uri_index.get(track_uri)
+        if track_index is None:
+            return None
+
+        return np.array(self.feature_matrix[track_index], dtype=np.float64)
+
+    def build_profile_sums(self, track_uris_with_opinions):
+        """
+        Sum the feature vectors of the tracks a user liked and disliked, the starting point of a profile that is then
+        kept up to date one opinion at a time
+
+        Args:
+            track_uris_with_opinions (list): The (track_uri, opinion, ...) tuples of the user
+
+        Returns:
+            tuple: The liked sum, liked count, disliked sum and disliked count
+        """
+        liked = [self.uri_index[opinion[0]] for opinion in track_uris_with_opinions
+                 if opinion[1] == 1 and opinion[0] in self.uri_index]
+        disliked = [self.uri_index[opinion[0]] for opinion in track_uris_with_opinions
+                    if opinion[1] == 0 and opinion[0] in self.uri_index]
+
+        return (self.feature_matrix[liked].sum(axis=0, dtype=np.float64), len(liked),
+                self.feature_matrix[disliked].sum(axis=0, dtype=np.float64), len(disliked))
+
+    def get_profile_vector(self, liked_sum, liked_count, disliked_sum, disliked_count):
+        """
+        Build a user's normalised query vector from their profile sums, the same vector get_profile_vectors builds
+        from all of their opinions
+
+        Returns:
+            numpy array: The normalised query vector, zero if the user has no opinions
+        """
+        if liked_count + disliked_count == 1:
+            profile_vector = liked_sum + disliked_sum
+        else:
+            profile_vector = (liked_sum / max(liked_count, 1)) - (disliked_sum / max(disliked_count, 1))
+
+        profile_vector = np.ascontiguousarray(profile_vector, dtype=np.float32).reshape(1, -1)
+        faiss.normalize_L2(profile_vector)
+        return profile_vector
+
+    def get_similarities_from_profile(self, liked_sum, liked_count, disliked_sum, disliked_count, exclude_uris=None, k=50):
+        """
+        Get the most similar tracks to a user's profile, in constant time however many opinions the user has
+
+        Args:
+            liked_sum, liked_count, disliked_sum, disliked_count: The user's profile sums
+            exclude_uris (list): Track URIs that must not be returned
+            k (int): The number of similar tracks to return
 
         Returns:
             indices (numpy array): Indices of the most similar tracks
             distances (numpy array): Distances of the most similar tracks
         """
+        profile_vector = self.get_profile_vector(liked_sum, liked_count, disliked_sum, disliked_count)
+        return self.search_profiles(profile_vector, k, [exclude_uris] if exclude_uris else None)[0]
 
-        
-        if len(track_uris_with_opinions) > 1:
-            
-            
-            liked_indices = [idx for uri, opinion, idx in track_uris_with_opinions if opinion == 1]
-            disliked_indices = [idx for uri, opinion, idx in track_uris_with_opinions if opinion == 0]
+    def search_profiles(self, profile_vectors, k=50, users_exclude_uris=None):
+        """
+        Search the nearest tracks of many users' profile vectors at once
 
-        
+        Args:
+            profile_vectors (numpy array): The normalised query vector of each user
+            k (int): The number of similar tracks to return for each user
+            users_exclude_uris (list): The track URIs to leave out of the results of each user
 
-            liked_vectors = self.feature_matrix[liked_indices] if liked_indices else np.zeros((1, self.feature_matrix.shape[1]))
-            disliked_vectors = self.feature_matrix[disliked_indices] if disliked_indices else np.zeros((1, self.feature_matrix.shape[1]))
+        Returns:
+            list: The indices and distances of the most similar tracks of each user, empty for users with no profile
+        """
+        exclude = None
+        if users_exclude_uris:
+            exclude = [{self.uri_index[uri] for uri in exclude_uris if uri in self.uri_index}
+                       for exclude_uris in users_exclude_uris]
 
-            liked_vector = self.get_weighted_vector(liked_vectors) if liked_indices else np.zeros(self.feature_matrix.shape[1])
-            disliked_vector = self.get_weighted_vector(disliked_vectors) if disliked_indices else np.zeros(self.feature_matrix.shape[1])
+        distances, indices = self.search_index(profile_vectors, k, exclude)
 
-            combined_vector = liked_vector - disliked_vector if liked_indices and disliked_indices else liked_vector if liked_indices else -disliked_vector
+        has_profile = profile_vectors.any(axis=1)
+        found = indices >= 0
+        return [(indices[user][found[user]], distances[user][found[user]]) if has_profile[user] else
+                (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32))
+                for user in range(len(profile_vectors))]
 
-            combined_vector = np.ascontiguousarray(combined_vector.reshape(1, -1))
-            combined_vector = combined_vector.astype(np.float32)
-            faiss.normalize_L2(combined_vector)
+    def get_centroid_vectors(self, track_uris_with_opinions, max_centroids=None):
+        """
+        Cluster a user's liked tracks into a few centroids, so a user who likes several distinct styles is not
+        represented by a single point between them. The mean of the disliked tracks is subtracted from each centroid.
 
-            distances, indices = self.index.search(combined_vector, 50)
-            return indices[0], distances[0]
+        Args:
+            track_uris_with_opinions (list): The (track_uri, opinion, ...) tuples of the user
+            max_centroids (int): The maximum number of centroids, defaults to MAX_CENTROIDS
 
+        Returns:
+            centroid_vectors (numpy array): The normalised centroids
+            sizes (numpy array): The number of liked tracks assigned to each centroid
+        """
+        max_centroids = max_centroids or self.MAX_CENTROIDS
+        liked = [self.uri_index[opinion[0]] for opinion in track_uris_with_opinions
+                 if opinion[1] == 1 and opinion[0] in self.uri_index]
+        disliked = [self.uri_index[opinion[0]] for opinion in track_uris_with_opinions
+                    if opinion[1] == 0 and opinion[0] in self.uri_index]
+
+        liked_vectors = np.ascontiguousarray(self.feature_matrix[liked], dtype=np.float32)
+        n_centroids = max(1, min(max_centroids, len(liked) // self.MIN_CENTROID_TRACKS))
+
+        if n_centroids == 1:
+            centroid_vectors = liked_vectors.mean(axis=0, keepdims=True)
+            sizes = np.array([len(liked)])
         else:
-            try:
-                track_vector = self.normalise_track_vector(self.feature_matrix, track_uris_with_opinions[0][0])
-                distances, indices = self.index.search(track_vector, 50)
-                return indices[0], distances[0]
-            except Exception as e:
-                print(f"An error occurred: {e}")
-                raise
+            # A profile has far fewer likes than faiss expects per centroid, which only makes it print a warning
+            kmeans = faiss.Kmeans(liked_vectors.shape[1], n_centroids, niter=20, seed=0, spherical=True,
+                                  min_points_per_centroid=1)
+            kmeans.train(liked_vectors)
+            _, assignments = kmeans.index.search(liked_vectors, 1)
+            sizes = np.bincount(assignments[:, 0], minlength=n_centroids)
+            centroid_vectors = kmeans.centroids[sizes > 0]
+            sizes = sizes[sizes > 0]
+
+        if disliked:
+            centroid_vectors = centroid_vectors - self.feature_matrix[disliked].mean(axis=0, dtype=np.float32)
+
+        centroid_vectors = np.ascontiguousarray(centroid_vectors, dtype=np.float32)
+        faiss.normalize_L2(centroid_vectors)
+        return centroid_vectors, sizes
+
+    def get_similarities_by_centroids(self, track_uris_with_opinions, k=50, exclude_uris=None, max_centroids=None):
+        """
+        Get the most similar tracks to each of a user's taste centroids with one batched search. Every centroid gets a
+        share of the k results in proportion to the number of liked tracks it summarises, taken in order of
+        similarity and skipping tracks another centroid already returned.
+
+        Args:
+            track_uris_with_opinions (list): The (track_uri, opinion, ...) tuples of the user
+            k (int): The number of similar tracks to return
+            exclude_uris (list): Track URIs that must not be returned
+            max_centroids (int): The maximum number of centroids to search, bounding the latency
+
+        Returns:
+            indices (numpy array): Indices of the most similar tracks
+            distances (numpy array): Distances of the most similar tracks
+        """
+        if not any(opinion[1] == 1 and opinion[0] in self.uri_index for opinion in track_uris_with_opinions):
+            return self.get_similarities(track_uris_with_opinions, exclude_uris, k)
+
+        centroid_vectors, sizes = self.get_centroid_vectors(track_uris_with_opinions, max_centroids)
+        results = self.search_profiles(centroid_vectors, k, [exclude_uris] * len(centroid_vectors) if exclude_uris else None)
+
+        # Split k between the centroids by largest remainder
+        shares = k * sizes / sizes.sum()
+        quotas = np.floor(shares).astype(int)
+        quotas[np.argsort(quotas - shares)[:k - quotas.sum()]] += 1
+
+        indices, distances = [], []
+        for (centroid_indices, centroid_distances), quota in zip(results, quotas):
+            taken = 0
+            for index, distance in zip(centroid_indices, centroid_distances):
+                if taken == quota:
+                    break
+                if index not in indices:
+                    indices.append(index)
+                    distances.append(distance)
+                    taken += 1
+
+        # Fill any shortfall with the best remaining results of all centroids
+        if len(indices) < k:
+            leftovers = sorted(((distance, index) for centroid_indices, centroid_distances in results
+                                for index, distance in zip(centroid_indices, centroid_distances) if index not in indices),
+                               reverse=True)
+            for distance, index in leftovers:
+                if len(indices) == k:
+                    break
+                if index not in indices:
+                    indices.append(index)
+                    distances.append(distance)
+
+        return np.array(indices, dtype=np.int64), np.array(distances, dtype=np.float32)
+
+    def get_similarities_batch(self, users_track_uris_with_opinions, k=50, users_exclude_uris=None):
+        """
+        Get the most similar tracks for many users with a single FAISS search
+
+        Args:
+            users_track_uris_with_opinions (list): The (track_uri, opinion, ...) tuples of each user
+            k (int): The number of similar tracks to return for each user
+            users_exclude_uris (list): The track URIs to leave out of the results of each user, e.g. the tracks they
+                have already rated
+
+        Returns:
+            list: The indices and distances of the most similar tracks of each user, empty for users with no known tracks
+        """
+
+        if not users_track_uris_with_opinions:
+            return []
+
+        profile_vectors = self.get_profile_vectors(users_track_uris_with_opinions)
+        return self.search_profiles(profile_vectors, k, users_exclude_uris)
+
+    def get_similarities(self, track_uris_with_opinions, exclude_uris=None, k=50):
+        """
+        Get the similarities between the track vector and the feature matrix using FAISS
+
+        Args:
+            track_uris_with_opinions (list): The (track_uri, opinion, idx) tuples of the user
+            exclude_uris (list): Track URIs that must not be returned, the search still returns k other tracks
+            k (int): The number of similar tracks to return
+
+        Returns:
+            indices (numpy array): Indices of the most similar tracks
+            distances (numpy array): Distances of the most similar tracks
+        """
+
+        known_uris = [opinion[0] for opinion in track_uris_with_opinions if opinion[0] in self.uri_index]
+        if not known_uris:
+            raise ValueError("Track URI not found in the DataFrame")
+
+        # A single track is looked up in the neighbour graph
+        if len(known_uris) == 1:
+            return self.get_neighbours(known_uris[0], k, exclude_uris)
+
+        return self.get_similarities_batch([track_uris_with_opinions], k,
+                                           [exclude_uris] if exclude_uris else None)[0]
         
     def random_uri(self):
         return self.full_dataset.sample(n=1)["track_uri"].tolist()
@@ -626,12 +3242,48 @@ class ContentBasedFilter:
         Returns:
             list: A list of track details dictionaries
         """
-        matching_tracks = self.full_dataset[self.full_dataset["track_name"].str.contains(track_name, case=False, na=False, regex=True)]
-        if matching_tracks.empty:
+        rows = self.name_index.search(track_name, 50)
+        if not rows:
             return False, []
         
         
-        return True, matching_tracks["track_uri"].head(50).tolist()
+        return True, self.uri_array[rows].tolist()
+
+    def search_tracks_by_artist(self, artist_name, page=0, page_size=50):
+        """
+        Browse the tracks of an artist within the full_dataset
+
+        Args:
+            artist_name (str): The name of the artist
+            page (int): The page of results, starting from 0
+            page_size (int): The number of tracks on each page
+
+        Returns:
+            tuple: Whether any tracks were found, the track URIs on the page and the total number of matching tracks
+        """
+        rows, total = self.facet_index.search("artist", artist_name, page, page_size)
+        if not rows:
+            return False, [], total
+
+        return True, self.uri_array[rows].tolist(), total
+
+    def search_tracks_by_genre(self, genre, page=0, page_size=50):
+        """
+        Browse the tracks tagged with a genre within the full_dataset
+
+        Args:
+            genre (str): The genre
+            page (int): The page of results, starting from 0
+            page_size (int): The number of tracks on each page
+
+        Returns:
+            tuple: Whether any tracks were found, the track URIs on the page and the total number of matching tracks
+        """
+        rows, total = self.facet_index.search("genre", genre, page, page_size)
+        if not rows:
+            return False, [], total
+
+        return True, self.uri_array[rows].tolist(), total
 
     def search_tracks_by_uri(self, track_uri):
         """
@@ -643,7 +3295,7 @@ class ContentBasedFilter:
         Returns:
             dict: A dictionary of track details if found, otherwise None
         """
-        if track_uri in (self.full_dataset["track_uri"]).values:
+        if track_uri in self.uri_index:
             return True
         return False
     
@@ -656,44 +3308,80 @@ class ContentBasedFilter:
         df_list = [pd.read_csv(file) for file in csv_files]
         merged_df = pd.concat(df_list).drop_duplicates().reset_index(drop=True)
 
+        track_uris = merged_df['track_uri'].tolist()
+        track_infos = self.cache.fetch(
+            "tracks", track_uris, lambda uris: self.spotify_call(self.sp.tracks, uris)['tracks'], 50)
+        track_features = self.cache.fetch(
+            "audio_features", track_uris, lambda uris: self.spotify_call(self.sp.audio_features, uris), 100)
+
+        # Fetch each unique artist once in batches instead of once per track
+        artist_uris = list(dict.fromkeys(
+            track_info['artists'][0]['uri'] for track_info in track_infos if track_info and track_info['artists']))
+        artists = dict(zip(artist_uris, self.cache.fetch(
+            "artists", artist_uris, lambda uris: self.spotify_call(self.sp.artists, uris)['artists'], 50)))
+
         track_info_list = []
-        batch_size = 50
-        for i in range(0, len(merged_df), batch_size):
-            batch = merged_df['track_uri'][i:i + batch_size].tolist()
-            track_infos = self.spotify_call(self.sp.tracks, batch)['tracks']
-            track_features = self.spotify_call(self.sp.audio_features, batch)
-
-            for track_info, track_feature in zip(track_infos, track_features):
-                if track_info and track_feature:
-                    artist_info = self.sp.artist(track_info['artists'][0]['id']) if track_info['artists'] else None
-                    track_info_list.append({
-                        'artist_name': track_info['artists'][0]['name'] if track_info['artists'] else None,
-                        'track_uri': track_info['uri'],
-                        'artist_uri': track_info['artists'][0]['uri'] if track_info['artists'] else None,
-                        'track_name': track_info['name'],
-                        'artist_pop': artist_info['popularity'] if artist_info else None,
-                        'genres': artist_info['genres'] if artist_info else None,
-                        'danceability': track_feature['danceability'],
-                        'energy': track_feature['energy'],
-                        'key': track_feature['key'],
-                        'loudness': track_feature['loudness'],
-                        'mode': track_feature['mode'],
-                        'speechiness': track_feature['speechiness'],
-                        'acousticness': track_feature['acousticness'],
-                        'instrumentalness': track_feature['instrumentalness'],
-                        'liveness': track_feature['liveness'],
-                        'valence': track_feature['valence'],
-                        'tempo': track_feature['tempo'],
-                        'track_pop': track_info['popularity']
-                    })
-
-        # Create a DataFrame from the track info list
-        track_info_df = pd.DataFrame(track_info_list)
-
-        self.full_dataset = pd.concat([self.full_dataset, track_info_df], ignore_index=True).drop_duplicates(subset="track_uri")
-        self.full_dataset.to_csv(get_file_path("full_dataset.csv"), index=False)
-        self.process_data()
-        self.create_index()
+        for track_info, track_feature in zip(track_infos, track_features):
+            if track_info and track_feature:
+                artist_info = artists.get(track_info['artists'][0]['uri']) if track_info['artists'] else None
+                track_info_list.append({
+                    'artist_name': track_info['artists'][0]['name'] if track_info['artists'] else None,
+                    'track_uri': track_info['uri'],
+                    'artist_uri': track_info['artists'][0]['uri'] if track_info['artists'] else None,
+                    'track_name': track_info['name'],
+                    'artist_pop': artist_info['popularity'] if artist_info else None,
+                    'genres': artist_info['genres'] if artist_info else None,
+                    'danceability': track_feature['danceability'],
+                    'energy': track_feature['energy'],
+                    'key': track_feature['key'],
+                    'loudness': track_feature['loudness'],
+                    'mode': track_feature['mode'],
+                    'speechiness': track_feature['speechiness'],
+                    'acousticness': track_feature['acousticness'],
+                    'instrumentalness': track_feature['instrumentalness'],
+                    'liveness': track_feature['liveness'],
+                    'valence': track_feature['valence'],
+                    'tempo': track_feature['tempo'],
+                    'track_pop': track_info['popularity']
+                })
+
+        # Create a DataFrame from the track info list, keeping only tracks that are not in the dataset yet
+        track_info_df = pd.DataFrame(track_info_list, columns=self.FEATURE_COLUMNS)
+        new_tracks = track_info_df[~track_info_df["track_uri"].isin(self.uri_index.keys())].drop_duplicates(
+            subset="track_uri", ignore_index=True)
+
+        if new_tracks.empty:
+            print("No new tracks to add")
+            return
+
+        feature_pipeline = FeaturePipeline.load(get_file_path(self.FEATURE_PIPELINE_FILE))
+        index_rows = self.index.ntotal
+        start = len(self.full_dataset)
+
+        # Only the new tracks are written and added to the in-memory dataset and search indexes
+        self.release_vectors()
+        try:
+            self.append_to_dataset(new_tracks)
+            self.full_dataset = pd.concat([self.full_dataset, new_tracks[self.SERVING_COLUMNS]], ignore_index=True)
+            self.uri_array = np.concatenate([self.uri_array, new_tracks["track_uri"].to_numpy()])
+            for row, track_uri in enumerate(new_tracks["track_uri"], start):
+                self.uri_index.setdefault(track_uri, row)
+            self.load_search_indexes()
+
+            if feature_pipeline is None:
+                # No fitted transforms to reuse, rebuild everything
+                self.process_data()
+                self.create_index()
+
+            else:
+                self.add_tracks(new_tracks, feature_pipeline)
+                if len(self.full_dataset) - index_rows > index_rows * self.MAX_DELTA_FRACTION:
+                    self.compact_dataset()
+                    self.create_index()
+
+        finally:
+            # Map the vectors again even if the update failed, so searches keep working with the files on disk
+            self.load_vectors()
         
 
 
@@ -729,6 +3417,16 @@ class Database:
                                     password TEXT NOT NULL,
                                     account_type TEXT DEFAULT 'user'
                                 );''')
+
+                # Running sums of the feature vectors each user liked and disliked
+                cursor.execute('''CREATE TABLE IF NOT EXISTS user_profiles (
+                                    user_id INTEGER PRIMARY KEY,
+                                    liked_sum BLOB NOT NULL,
+                                    liked_count INTEGER NOT NULL,
+                                    disliked_sum BLOB NOT NULL,
+                                    disliked_count INTEGER NOT NULL,
+                                    feature_version TEXT NOT NULL
+                                );''')
                 connection.commit()
             except Error as e:
                 print(e)
@@ -836,11 +3534,12 @@ class Database:
             finally:
                 connection.close()           
     
-    def save_opinions(self, user_id, track_uri, opinion, idx):
+    def save_opinions(self, user_id, track_uri, opinion, idx, track_vector=None, feature_version=None):
         connection = self.create_connection()
         if connection is not None:
             try:
                 cursor = connection.cursor()
+                old_opinion = self.get_track_opinion(cursor, user_id, track_uri)
                 cursor.execute("""
                     INSERT INTO user_opinions (user_id, track_uri, opinion)
                     VALUES (?, ?, ?)
@@ -851,20 +3550,94 @@ class Database:
                     INSERT OR IGNORE INTO tracks (track_uri, idx)
                     VALUES (?, ?)
                 """, (track_uri, idx))
+
+                if track_vector is not None:
+                    self.update_user_profile(cursor, user_id, track_vector, old_opinion, opinion, feature_version)
                 connection.commit()
             except Error as e:
                 print(e)
             finally:
                 connection.close()
 
-    def delete_opinion(self, user_id, track_uri):
+    def delete_opinion(self, user_id, track_uri, track_vector=None, feature_version=None):
         connection = self.create_connection()
         if connection is not None:
             try:
                 cursor = connection.cursor()
+                old_opinion = self.get_track_opinion(cursor, user_id, track_uri)
                 cursor.execute('''
                     DELETE FROM user_opinions WHERE user_id = ? AND track_uri = ?;
                 ''', (user_id, track_uri))
+
+                if track_vector is not None:
+                    self.update_user_profile(cursor, user_id, track_vector, old_opinion, None, feature_version)
+                connection.commit()
+            except Error as e:
+                print(e)
+            finally:
+                connection.close()
+
+    def get_track_opinion(self, cursor, user_id, track_uri):
+        cursor.execute("SELECT opinion FROM user_opinions WHERE user_id = ? AND track_uri = ?", (user_id, track_uri))
+        row = cursor.fetchone()
+        return row[0] if row else None
+
+    def update_user_profile(self, cursor, user_id, track_vector, old_opinion, new_opinion, feature_version):
+        """
+        Moves a track vector between the liked and disliked sums of a user's profile when their opinion of the track
+        changes. Profiles built from other feature vectors are left for the recommender to rebuild.
+        """
+        if old_opinion == new_opinion:
+            return
+
+        cursor.execute('''SELECT liked_sum, liked_count, disliked_sum, disliked_count, feature_version
+                          FROM user_profiles WHERE user_id = ?''', (user_id,))
+        row = cursor.fetchone()
+        if row is None or row[4] != feature_version:
+            return
+
+        sums = {1: np.frombuffer(row[0], dtype=np.float64).copy(), 0: np.frombuffer(row[2], dtype=np.float64).copy()}
+        counts = {1: row[1], 0: row[3]}
+        if len(sums[1]) != len(track_vector):
+            return
+
+        if old_opinion in sums:
+            sums[old_opinion] -= track_vector
+            counts[old_opinion] -= 1
+        if new_opinion in sums:
+            sums[new_opinion] += track_vector
+            counts[new_opinion] += 1
+
+        cursor.execute('''UPDATE user_profiles SET liked_sum = ?, liked_count = ?, disliked_sum = ?, disliked_count = ?
+                          WHERE user_id = ?''', (sums[1].tobytes(), counts[1], sums[0].tobytes(), counts[0], user_id))
+
+    def get_user_profile(self, user_id):
+        connection = self.create_connection()
+        if connection is not None:
+            try:
+                cursor = connection.cursor()
+                cursor.execute('''SELECT liked_sum, liked_count, disliked_sum, disliked_count, feature_version
+                                  FROM user_profiles WHERE user_id = ?''', (user_id,))
+                row = cursor.fetchone()
+                if row:
+                    return (np.frombuffer(row[0], dtype=np.float64), row[1],
+                            np.frombuffer(row[2], dtype=np.float64), row[3], row[4])
+            except Error as e:
+                print(e)
+            finally:
+                connection.close()
+        return None
+
+    def save_user_profile(self, user_id, liked_sum, liked_count, disliked_sum, disliked_count, feature_version):
+        connection = self.create_connection()
+        if connection is not None:
+            try:
+                cursor = connection.cursor()
+                cursor.execute('''INSERT OR REPLACE INTO user_profiles
+                                  (user_id, liked_sum, liked_count, disliked_sum, disliked_count, feature_version)
+                                  VALUES (?, ?, ?, ?, ?, ?)''',
+                               (user_id, np.asarray(liked_sum, dtype=np.float64).tobytes(), liked_count,
+                                np.asarray(disliked_sum, dtype=np.float64).tobytes(), disliked_count, feature_version))
                 connection.commit()
             except Error as e:
                 print(e)
@@ -989,9 +3762,10 @@ class Database:
 
 
 class SpotifyClient:
-    def __init__(self, client_id, client_secret):
+    def __init__(self, client_id, client_secret, cache=None):
         self.client_id = client_id
         self.client_secret = client_secret
+        self.cache = cache or ResponseCache()
         self.access_token = False
         self.sp = self.create_spotify_client()
         self.deezer = deezer.Client()
@@ -1004,7 +3778,8 @@ class SpotifyClient:
     def get_track_details(self, track_uris, market="US"):
         track_details_list = []
         
-        tracks = self.sp.tracks(track_uris, market=market)['tracks']
+        tracks = self.cache.fetch(
+            f"tracks_{market}", track_uris, lambda uris: self.sp.tracks(uris, market=market)['tracks'], 50)
         for i, track in enumerate(tracks):
             album_cover = track['album']['images'][0]['url'] if track['album']['images'] else None
             artist_name = track['artists'][0]['name'] if track['artists'] else None
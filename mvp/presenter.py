@@ -1,5 +1,5 @@
 from PySide6.QtCore import QObject
-from model import Database, SpotifyClient, ContentBasedFilter, SpotifyDatasetProcessor, get_file_path
+from model import Database, SpotifyClient, ContentBasedFilter, SpotifyDatasetProcessor, ResponseCache, PipelineMetrics, get_file_path
 import re
 from dotenv import load_dotenv
 import os
@@ -13,11 +13,21 @@ class Presenter(QObject):
         SPOTIFY_CLIENT_ID = os.getenv('SPOTIFY_CLIENT_ID')
         self.view = view
         self.user_db = Database()
-        self.spotify_client = SpotifyClient(client_id=SPOTIFY_CLIENT_ID, client_secret=SPOTIFY_CLIENT_SECRET)
-        self.cbf = ContentBasedFilter(client_id=SPOTIFY_CLIENT_ID, client_secret=SPOTIFY_CLIENT_SECRET)
-        self.processor = SpotifyDatasetProcessor(client_id=SPOTIFY_CLIENT_ID, client_secret=SPOTIFY_CLIENT_SECRET)
+        self.response_cache = ResponseCache()
+        self.pipeline_metrics = PipelineMetrics()
+        self.spotify_client = SpotifyClient(client_id=SPOTIFY_CLIENT_ID, client_secret=SPOTIFY_CLIENT_SECRET, cache=self.response_cache)
+        # MATRIX_DTYPE is float32 or float16, INDEX_TYPE defaults to an index storing vectors at the same precision
+        self.cbf = ContentBasedFilter(client_id=SPOTIFY_CLIENT_ID, client_secret=SPOTIFY_CLIENT_SECRET, cache=self.response_cache, metrics=self.pipeline_metrics,
+                                      mmap=os.getenv('FEATURE_MMAP', '1') != '0', index_type=os.getenv('INDEX_TYPE'),
+                                      search_params=os.getenv('INDEX_SEARCH_PARAMS'),
+                                      feature_chunk_size=int(os.getenv('FEATURE_CHUNK_SIZE', 0)) or None,
+                                      workers=int(os.getenv('FEATURE_WORKERS', os.cpu_count())),
+                                      profile_mode=os.getenv('PROFILE_MODE', 'mean'),
+                                      matrix_dtype=os.getenv('MATRIX_DTYPE', 'float32'))
+        self.processor = SpotifyDatasetProcessor(client_id=SPOTIFY_CLIENT_ID, client_secret=SPOTIFY_CLIENT_SECRET, cache=self.response_cache, metrics=self.pipeline_metrics)
         self.email = ""
         self.user_id = ""
+        self.search_total = 0
 
     
     def on_login_clicked(self, email, password):
@@ -157,18 +167,38 @@ class Presenter(QObject):
         
         return True
         
+    def get_user_profile(self):
+        # Rebuild the user's profile sums from all of their opinions if they are missing or were summed from
+        # feature vectors of an earlier feature pipeline or matrix precision
+        feature_version = self.cbf.feature_version
+        profile = self.user_db.get_user_profile(self.user_id)
+        if profile is None or profile[4] != feature_version:
+            track_uris_with_opinions = self.user_db.get_user_track_uris_with_opinions(self.user_id)
+            profile = self.cbf.build_profile_sums(track_uris_with_opinions) + (feature_version,)
+            self.user_db.save_user_profile(self.user_id, *profile)
+        return profile
+
     def fetch_track_details(self):
-        liked_track_uris = self.user_db.get_user_liked_track_uris(self.user_id)
-        if not liked_track_uris:
+        liked_sum, liked_count, disliked_sum, disliked_count, _ = self.get_user_profile()
+        if not liked_count:
             print('No liked tracks')
             track_uris = self.cbf.random_uri()
         else:
             print('Liked tracks')
             
-            track_uris_with_opinions = self.user_db.get_user_track_uris_with_opinions(self.user_id)
             track_uris = self.user_db.get_user_track_uris(self.user_id)
-            indices, _ = self.cbf.get_similarities(track_uris_with_opinions)
-            track_uris = [uri for uri in self.cbf.get_uris(indices) if uri not in track_uris]
+            # Rated tracks are excluded by the search itself, so it always returns a full page of new tracks
+            if liked_count == 1 and not disliked_count:
+                # A single liked track is looked up in the precomputed neighbour graph
+                seed_uri = next(uri for uri in track_uris if self.cbf.get_index(uri) is not None)
+                indices, _ = self.cbf.get_neighbours(seed_uri, exclude_uris=track_uris)
+            elif self.cbf.profile_mode == "centroids":
+                track_uris_with_opinions = self.user_db.get_user_track_uris_with_opinions(self.user_id)
+                indices, _ = self.cbf.get_similarities_by_centroids(track_uris_with_opinions, exclude_uris=track_uris)
+            else:
+                indices, _ = self.cbf.get_similarities_from_profile(liked_sum, liked_count, disliked_sum, disliked_count,
+                                                                    exclude_uris=track_uris)
+            track_uris = self.cbf.get_uris(indices)
 
         track_details_list = self.spotify_client.get_track_details(track_uris)
         return track_details_list
@@ -184,13 +214,15 @@ class Presenter(QObject):
     
     def save_opinion(self, track_uri, opinion):
         if self.get_opinions(track_uri) is not None and opinion == -1:
-            self.user_db.delete_opinion(self.user_id, track_uri)
+            self.user_db.delete_opinion(self.user_id, track_uri, self.cbf.get_track_vector(track_uri),
+                                        self.cbf.feature_version)
             
         elif self.get_opinions(track_uri) is None and opinion == -1:
             pass
             
         else:
-            self.user_db.save_opinions(self.user_id, track_uri, opinion, self.cbf.get_index(track_uri))
+            self.user_db.save_opinions(self.user_id, track_uri, opinion, self.cbf.get_index(track_uri),
+                                       self.cbf.get_track_vector(track_uri), self.cbf.feature_version)
 
     def get_track_details_by_uri(self, track_uri):
         # Implement logic to get track details by URI
@@ -215,6 +247,19 @@ class Presenter(QObject):
         
         return [], []
     
+    def get_track_details_by_facet(self, facet, value, page=0):
+        # Browse tracks by artist or genre, one page at a time, keeping the total so the view knows if there are more
+        if facet == "artist":
+            success, track_uris, self.search_total = self.cbf.search_tracks_by_artist(value, page)
+        else:
+            success, track_uris, self.search_total = self.cbf.search_tracks_by_genre(value, page)
+
+        if success:
+            opinions = self.user_db.get_opinions_by_uris(track_uris)
+            return self.spotify_client.get_track_details(track_uris), opinions
+
+        return [], []
+    
     def get_user_accounts(self):
         pass
 
@@ -226,6 +271,18 @@ class Presenter(QObject):
     
     def update_track_database(self):
         self.cbf.update_track_database()
+
+    def build_neighbour_graph(self):
+        self.cbf.build_neighbour_graph()
+
+    def more_like_this(self, track_uri):
+        # Tracks similar to a single track, leaving out the ones the user has already rated
+        track_uris = self.user_db.get_user_track_uris(self.user_id)
+        indices, _ = self.cbf.get_neighbours(track_uri, exclude_uris=track_uris)
+        track_details_list = self.spotify_client.get_track_details(self.cbf.get_uris(indices))
+        for track in track_details_list:
+            track["opinion"] = None
+        return track_details_list
     
     def clean_spotify_dataset(self, folder_path):
         if folder_path.startswith("file:///"):
@@ -233,17 +290,17 @@ class Presenter(QObject):
         self.processor.directory = sorted(glob.glob(folder_path + r"/*json"), key=len)
         print(folder_path)
         print(sorted(glob.glob(folder_path + r"/*json"), key=len))
-        self.processor.clean_data()
+        self.processor.clean_data(workers=int(os.getenv('INGEST_WORKERS', os.cpu_count())))
 
     def get_spotify_dataset_audio_features(self, csv_file):
         if csv_file.startswith("file:///"):
             csv_file = csv_file[8:] 
-        self.processor.csv_file = csv_file
-        self.processor.get_audio_features(get_file_path("audio_features.csv"))
+        self.processor.dataset_file = csv_file
+        self.processor.get_audio_features(get_file_path("audio_features.parquet"))
     
     def create_full_dataset(self, full_dataset_files):
         self.processor.audio_features_file = full_dataset_files[0]
-        self.processor.csv_file = full_dataset_files[1]
+        self.processor.dataset_file = full_dataset_files[1]
         self.processor.join_dataset()
     
     def get_user_tracks_with_opinions(self):
@@ -275,7 +332,10 @@ class Presenter(QObject):
         else:
             return None
     
-    def search(self, search_query):
+    def search(self, search_query, page=0):
+        # Only artist and genre searches have further pages
+        self.search_total = 0
+
         if search_query.startswith("spotify:track:"):
             # Handle track URI search
             track_details_list, opinions = self.get_track_details_by_uri(search_query)
@@ -300,6 +360,25 @@ class Presenter(QObject):
         elif search_query == " ":
             return []
 
+        elif search_query.startswith("artist:") or search_query.startswith("genre:"):
+            # Handle artist and genre search
+            facet, value = search_query.split(":", 1)
+            track_details_list, opinions = self.get_track_details_by_facet(facet, value.strip(), page)
+
+            if not opinions:
+                opinions = [(track["track_uri"], None) for track in track_details_list]
+
+            if track_details_list and opinions:
+
+                opinions = {uri[0]: uri[1] for uri in opinions}
+                for track in track_details_list:
+                    track_uri = track["track_uri"]
+                    track["opinion"] = opinions.get(track_uri, None)
+                return track_details_list
+
+            else:
+                return []
+
         else:
             # Handle track name search
             track_details_list, opinions = self.get_track_details_by_name(search_query)
@@ -0,0 +1,83 @@
+import os
+import random
+import tempfile
+import unittest
+
+from model import TrackNameIndex
+
+
+class TrackNameIndexTest(unittest.TestCase):
+    """
+    Checks the track name index returns the same rows in the same order as a brute-force scan of every name
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        rng = random.Random(0)
+        words = ["love", "lovely", "low", "night", "nights", "knight", "the", "theory", "blue", "blues", "moon",
+                 "moonlight", "my", "way", "heart", "hearts", "in", "intro", "outro", "dance"]
+        cls.track_names = ["Intro", "Love", "love", "Lové!", "The Night", None]
+        cls.track_names += [" ".join(rng.choice(words) for _ in range(rng.randint(1, 4))).title()
+                            for _ in range(20000)]
+        cls.index = TrackNameIndex.build(cls.track_names)
+        cls.queries = ["l", "lo", "love", "Love", "lové", "night", "igh", "ight", "the n", "the night", "my way",
+                       "moon lig", "hearts in", "eart", "x", "zzz", "in", "intro", "blue moon", "way ni", "ove ni"]
+
+    def brute_force(self, query, limit=50):
+        """
+        Ranks every name by the tiers of TrackNameIndex.search without using the index
+
+        Args:
+            query (str): The text to search for
+            limit (int): The number of rows to return
+
+        Returns:
+            list: The matching rows
+        """
+        query = TrackNameIndex.normalise_name(query)
+        if not query:
+            return []
+
+        names = [TrackNameIndex.normalise_name(name) for name in self.track_names]
+        words = query.split()
+        tiers = [
+            lambda name: name == query,
+            lambda name: name.startswith(query),
+            (lambda name: any(token.startswith(query) for token in name.split())) if len(words) == 1 else
+            (lambda name: " " + query in " " + name),
+            lambda name: len(query) >= 3 and query in name,
+        ]
+
+        results = []
+        for tier in tiers:
+            found = set(results)
+            rows = sorted((row for row, name in enumerate(names) if tier(name)), key=lambda row: (len(names[row]), row))
+            results += [row for row in rows if row not in found]
+        return results[:limit]
+
+    def assert_matches_brute_force(self, index):
+        for query in self.queries:
+            for limit in (1, 50, 500):
+                with self.subTest(query=query, limit=limit):
+                    self.assertEqual(index.search(query, limit), self.brute_force(query, limit))
+
+    def test_search_matches_brute_force(self):
+        self.assert_matches_brute_force(self.index)
+
+    def test_partitioned_ranking_matches_brute_force(self):
+        # Rank every candidate set a partition at a time
+        index = TrackNameIndex.build(self.track_names)
+        index.MAX_SORTED_CANDIDATES = 0
+        self.assert_matches_brute_force(index)
+
+    def test_saved_index_matches_brute_force(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            file_path = os.path.join(temp_dir, "track_name_index.pkl")
+            self.index.save(file_path, ("full_dataset.parquet", 1))
+
+            self.assertIsNone(TrackNameIndex.load(file_path, ("full_dataset.parquet", 2)))
+            self.assert_matches_brute_force(TrackNameIndex.load(file_path, ("full_dataset.parquet", 1)))
+
+
+if __name__ == "__main__":
+    unittest.main()
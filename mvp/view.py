@@ -1,4 +1,5 @@
 import sys
+import multiprocessing
 from pathlib import Path
 
 from PySide6.QtGui import QGuiApplication
@@ -218,6 +219,14 @@ class Backend(QObject):
     @Slot(str, result=list)
     def search(self, search_query):
         return self.presenter.search(search_query)
+
+    @Slot(str, int, result=list)
+    def search_page(self, search_query, page):
+        return self.presenter.search(search_query, page)
+
+    @Slot(result=int)
+    def search_total(self):
+        return self.presenter.search_total
         
     
     @Slot(str, str, result=list)
@@ -244,6 +253,14 @@ class Backend(QObject):
     def update_track_database(self):
         self.presenter.update_track_database()
 
+    @Slot()
+    def build_neighbour_graph(self):
+        self.presenter.build_neighbour_graph()
+
+    @Slot(str, result=list)
+    def more_like_this(self, track_uri):
+        return self.presenter.more_like_this(track_uri)
+
     @Slot(str)
     def clean_spotify_dataset(self, folder_path):
         self.presenter.clean_spotify_dataset(folder_path)
@@ -302,6 +319,7 @@ def main():
     app.exec()
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
     main()
 
     